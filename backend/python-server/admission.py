@@ -0,0 +1,110 @@
+"""
+Request coalescing and admission control for the expensive endpoints.
+
+SingleFlight lets concurrent identical requests share one computation;
+ConcurrencyLimiter caps how many computations run at once per endpoint and
+sheds load (the caller answers 503) once too many are already waiting.
+Both are thread-based, so they work the same under the threaded Flask server
+and in the ASGI app's model executor.
+"""
+import os
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Run fn once per key at a time; callers arriving meanwhile get the same result"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.shared = 0  # Calls answered from another caller's computation
+
+    def do(self, key, fn, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            # Forget the key before waking followers, so later requests compute fresh results
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class ConcurrencyLimiter:
+    """
+    At most max_concurrent holders; at most max_queue callers waiting for a
+    slot, each for at most timeout seconds. acquire() returns False when the
+    request should be shed.
+
+    Args:
+        max_concurrent (int): Computations allowed to run at once
+        max_queue (int): Callers allowed to wait; more are shed immediately
+        timeout (float, optional): Longest wait for a slot in seconds
+    """
+    def __init__(self, max_concurrent, max_queue, timeout=None):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.shed = 0
+
+    def acquire(self):
+        if self._slots.acquire(blocking=False):
+            return True
+        with self._lock:
+            if self.waiting >= self.max_queue:
+                self.shed += 1
+                return False
+            self.waiting += 1
+        acquired = False
+        try:
+            acquired = self._slots.acquire(timeout=self.timeout)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+                self.shed += not acquired
+        return acquired
+
+    def release(self):
+        self._slots.release()
+
+    def status(self):
+        return {'max_concurrent': self.max_concurrent, 'max_queue': self.max_queue,
+                'waiting': self.waiting, 'shed': self.shed}
+
+
+def limiter_from_env(endpoint, max_concurrent, max_queue, timeout=None):
+    """
+    Limiter with defaults overridable by an environment variable such as
+    LIMIT_GET_RECOMMENDATION="4:32" (max concurrent:max queue).
+    """
+    value = os.environ.get(f'LIMIT_{endpoint.upper()}')
+    if value:
+        max_concurrent, max_queue = (int(part) for part in value.split(':'))
+    timeout = float(os.environ.get('QUEUE_TIMEOUT', timeout or 0)) or None
+    return ConcurrencyLimiter(max_concurrent, max_queue, timeout)
@@ -0,0 +1,488 @@
+"""
+Framework-independent request handlers shared by the Flask app (app.py) and
+the ASGI app (asgi_app.py). Each handler takes plain arguments and returns
+(body, HTTP status) or (body, HTTP status, response headers), where body is
+JSON-serializable, an already encoded serialization.EncodedBody, a
+serialization.StreamingBody, or None (304).
+"""
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import random
+import signal
+from datetime import datetime
+
+from admission import SingleFlight, limiter_from_env
+from metrics import CONTENT_TYPE, Metrics, span
+from model_registry import ModelRegistry
+from profiling import RequestProfiler
+from serialization import EncodedBody, ResponseCache, StreamingBody, ndjson_lines
+from warranties import icon_defaults, build_warranties
+
+# Per-request details go to debug logging, off unless a handler enables it
+logger = logging.getLogger(__name__)
+
+# Trie, event store and recommender live in one versioned bundle that
+# /admin/reload can replace without restarting the server
+# SIMILARITY_SHARDS=N splits product similarity across N local shard processes;
+# the recommender then routes each neighbor query to them over Unix sockets
+# RECOMMENDER_PRECISION=float32|float16|int8 stores the product vectors compactly (default float64)
+registry = ModelRegistry(n_shards=int(os.environ.get('SIMILARITY_SHARDS', '0')),
+                         precision=os.environ.get('RECOMMENDER_PRECISION', 'float64'))
+# Components load in background threads; each endpoint serves once its own are ready
+registry.start()
+
+# Base seed of the warranty date generator (responses are reproducible per user)
+WARRANTY_SEED = int(os.environ.get('WARRANTY_SEED', '0'))
+WARRANTY_COLUMNS = ['warranty_title', 'warranty_icon', 'brand']
+# Default and largest page of /get_warranties?limit=&cursor=, and events per streamed chunk
+WARRANTY_PAGE_SIZE = int(os.environ.get('WARRANTY_PAGE_SIZE', '50'))
+WARRANTY_PAGE_MAX = int(os.environ.get('WARRANTY_PAGE_MAX', '500'))
+WARRANTY_STREAM_CHUNK = int(os.environ.get('WARRANTY_STREAM_CHUNK', '256'))
+
+# Concurrent identical requests share one computation, and each expensive endpoint
+# runs a bounded number of them at once; callers beyond its queue depth (or waiting
+# longer than QUEUE_TIMEOUT seconds) get 503 so latency stays bounded under bursts
+CPUS = os.cpu_count() or 1
+flights = {endpoint: SingleFlight() for endpoint in ('autocomplete', 'get_recommendation', 'get_warranties')}
+limiters = {
+    'autocomplete': limiter_from_env('autocomplete', 4 * CPUS, 64, timeout=1.0),
+    'get_recommendation': limiter_from_env('get_recommendation', CPUS, 32, timeout=2.0),
+    'get_warranties': limiter_from_env('get_warranties', 2 * CPUS, 32, timeout=2.0),
+    # Open NDJSON streams, held while the client reads; a full server sheds new ones instead of queueing
+    'get_warranties_stream': limiter_from_env('get_warranties_stream', 16 * CPUS, 0),
+}
+
+# Client/proxy caching of responses that only change with the model version
+AUTOCOMPLETE_MAX_AGE = int(os.environ.get('AUTOCOMPLETE_MAX_AGE', '300'))
+RECOMMENDATION_MAX_AGE = int(os.environ.get('RECOMMENDATION_MAX_AGE', '60'))
+
+
+def not_ready(component):
+    return {'error': f'The {component} is still loading', 'components': registry.components}, 503
+
+
+# Ready-encoded bodies of the cacheable responses, keyed by model version and input
+caches = {
+    'autocomplete': ResponseCache(int(os.environ.get('AUTOCOMPLETE_CACHE_SIZE', '8192'))),
+    'recommendations': ResponseCache(int(os.environ.get('RECOMMENDATION_CACHE_SIZE', '16384'))),
+}
+
+
+# cProfile traces of sampled requests and of requests whose X-Profile header carries ADMIN_TOKEN
+profiler = RequestProfiler()
+PROFILE_SORT_KEYS = ('cumulative', 'tottime', 'ncalls', 'filename')
+
+# Request counts, errors and latencies per route, recorded by app.py/asgi_app.py
+ROUTES = ('/autocomplete', '/health', '/ready', '/metrics', '/admin/reload', '/admin/profiles',
+          '/admin/profiles/<name>', '/get_recommendation', '/get_warranties')
+request_metrics = Metrics(ROUTES)
+
+
+def overloaded(endpoint):
+    return {'error': f'Too many {endpoint} requests, try again later'}, 503
+
+
+def _admitted(endpoint, key, handler, *args):
+    """
+    Run handler(*args) once per key at a time, within the endpoint's limiter.
+    Keys start with the version of the bundle the handler is given.
+    """
+    limiter = limiters[endpoint]
+
+    def run():
+        with span('queue'):
+            admitted = limiter.acquire()
+        if not admitted:
+            return overloaded(endpoint)
+        try:
+            return handler(*args)
+        finally:
+            limiter.release()
+
+    return flights[endpoint].do(key, run)
+
+
+def admission_status():
+    return {endpoint: {**limiter.status(), 'coalesced': flights[endpoint].shared if endpoint in flights else 0}
+            for endpoint, limiter in limiters.items()}
+
+
+def cache_status():
+    return {name: cache.status() for name, cache in caches.items()}
+
+
+def etag(*parts):
+    # Weak: the same tag covers the plain and the gzipped representation
+    return 'W/"' + hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest() + '"'
+
+
+def etag_matches(if_none_match, tag):
+    """Whether an If-None-Match header value lists tag (weak comparison)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    opaque = tag.removeprefix('W/')
+    return any(candidate.strip().removeprefix('W/') == opaque for candidate in if_none_match.split(','))
+
+
+def _conditional(tag, cache_control, if_none_match, compute, *args):
+    """304 without calling compute when the client has tag; otherwise compute(*args) with caching headers"""
+    headers = {'ETag': tag, 'Cache-Control': cache_control}
+    if etag_matches(if_none_match, tag):
+        return None, 304, headers
+    body, status = compute(*args)
+    return (body, status, headers) if status == 200 else (body, status)
+
+
+def autocomplete(query, if_none_match=None):
+    query = (query or '').lower()
+    if not query:
+        return [], 200
+    # Read the bundle once: the tag and the body come from the same model version
+    bundle = registry.active
+    if bundle.trie is None:
+        return not_ready('trie')
+    # Suggestions only change with the trie, which is versioned with the bundle
+    return _conditional(etag('autocomplete', bundle.version, query), f'public, max-age={AUTOCOMPLETE_MAX_AGE}',
+                        if_none_match, _admitted, 'autocomplete', (bundle.version, query), _autocomplete, bundle, query)
+
+
+def _autocomplete(bundle, query):
+    # Get suggestions from trie (encoded once per prefix and model version)
+    return caches['autocomplete'].get_or_build(
+        (bundle.version, query), bundle.trie.autocomplete, query, 5
+    ), 200
+
+
+def health():
+    # Liveness only: answers as soon as the process is up, even while models load
+    return {'status': 'running', 'version': registry.version}, 200
+
+
+def ready():
+    is_ready = registry.is_ready()
+    body = {'ready': is_ready, 'components': registry.components, 'model': registry.status(),
+            'admission': admission_status(), 'caches': cache_status()}
+    return body, 200 if is_ready else 503
+
+
+def _model_gauges():
+    bundle = registry.active
+    components = dict(registry.components)
+    gauges = [
+        ('model_info', 'Active model version', [({'version': bundle.version}, 1)]),
+        ('model_load_seconds', 'Duration of the last complete model load', [({}, registry.last_load_seconds)]),
+        ('model_component_load_seconds', 'Load time of each model component',
+         [({'component': name}, info.get('seconds')) for name, info in components.items()]),
+        ('model_component_ready', 'Whether each model component is ready',
+         [({'component': name}, info.get('status') == 'ready') for name, info in components.items()]),
+    ]
+    if bundle.trie is not None:
+        gauges.append(('trie_words', 'Words in the autocomplete trie', [({}, len(bundle.trie.all_words))]))
+    recommender = bundle.recommender
+    if recommender is not None:
+        # Sharded recommenders hold no matrix; their shard processes do
+        matrix = recommender.product_vectors
+        rows, columns = matrix.shape if matrix is not None else (len(recommender.product_ids), 0)
+        gauges += [
+            ('recommender_matrix_rows', 'Products in the recommender matrix', [({}, rows)]),
+            ('recommender_matrix_columns', 'Users in the recommender matrix', [({}, columns)]),
+            ('recommender_matrix_bytes', 'Memory of the recommender matrix',
+             [({}, matrix.nbytes if matrix is not None else 0)]),
+        ]
+    return gauges
+
+
+def _serving_gauges():
+    cache_statuses = [(name, cache.status()) for name, cache in caches.items()]
+    admission = admission_status()
+    return [
+        ('response_cache_hit_ratio', 'Hits over lookups of each response cache',
+         [({'cache': name}, status['hits'] / max(1, status['hits'] + status['misses'])) for name, status in cache_statuses]),
+        ('response_cache_hits_total', 'Hits of each response cache',
+         [({'cache': name}, status['hits']) for name, status in cache_statuses], 'counter'),
+        ('response_cache_misses_total', 'Misses of each response cache',
+         [({'cache': name}, status['misses']) for name, status in cache_statuses], 'counter'),
+        ('response_cache_entries', 'Entries of each response cache',
+         [({'cache': name}, status['entries']) for name, status in cache_statuses]),
+        ('admission_shed_total', 'Requests shed by each endpoint limiter',
+         [({'endpoint': name}, status['shed']) for name, status in admission.items()], 'counter'),
+        ('admission_waiting', 'Requests waiting for a slot of each endpoint limiter',
+         [({'endpoint': name}, status['waiting']) for name, status in admission.items()]),
+        ('admission_coalesced_total', 'Requests answered by an identical in-flight request',
+         [({'endpoint': name}, status['coalesced']) for name, status in admission.items()], 'counter'),
+    ]
+
+
+def metrics():
+    text = request_metrics.render([*_model_gauges(), *_serving_gauges()])
+    return EncodedBody(text.encode(), content_type=CONTENT_TYPE), 200
+
+
+def _admin_denied(admin_token_header):
+    """Error response for an admin request, or None when it carries ADMIN_TOKEN"""
+    admin_token = os.environ.get('ADMIN_TOKEN')
+    if not admin_token:
+        # Closed unless an operator configured a token
+        return {'error': 'Admin endpoints are disabled; set ADMIN_TOKEN to enable them'}, 403
+    if not hmac.compare_digest((admin_token_header or '').encode(), admin_token.encode()):
+        return {'error': 'Unauthorized'}, 401
+    return None
+
+
+def profile_requested(profile_header):
+    # The X-Profile header has to carry ADMIN_TOKEN; without a token nobody can force a profile
+    return bool(profile_header) and _admin_denied(profile_header) is None
+
+
+def reload_models(version, admin_token_header):
+    denied = _admin_denied(admin_token_header)
+    if denied:
+        return denied
+
+    if registry.reload_parent:
+        # Prefork worker: the parent rebuilds from source and replaces every worker
+        if version:
+            return {'error': 'The prefork server only reloads from the source datasets'}, 501
+        os.kill(registry.reload_parent, signal.SIGHUP)
+        return {'message': 'Model reload requested from the prefork server', 'model': registry.status()}, 202
+
+    # Reload a saved artifact version, or rebuild from the source datasets
+    if not registry.load_in_background(version):
+        return {'error': 'A model load is already running', 'model': registry.status()}, 409
+    return {'message': 'Model load started', 'model': registry.status()}, 202
+
+
+def list_profiles(admin_token_header):
+    denied = _admin_denied(admin_token_header)
+    if denied:
+        return denied
+    return {'directory': profiler.directory, 'sample_rate': profiler.sample_rate, 'profiles': profiler.traces()}, 200
+
+
+def get_profile(name, admin_token_header, output='text', sort='cumulative'):
+    """A saved trace as a pstats text report, or as the raw .prof file with output='raw'"""
+    denied = _admin_denied(admin_token_header)
+    if denied:
+        return denied
+    path = profiler.path_of(name)
+    if path is None:
+        return {'error': 'Unknown profile'}, 404
+    if output == 'raw':
+        with open(path, 'rb') as f:
+            return EncodedBody(f.read(), compress_min_bytes=0, content_type='application/octet-stream'), 200
+    if sort not in PROFILE_SORT_KEYS:
+        return {'error': f'sort must be one of {", ".join(PROFILE_SORT_KEYS)}'}, 400
+    text = profiler.summary(name, sort=sort)
+    return EncodedBody(text.encode(), content_type='text/plain; charset=utf-8'), 200
+
+
+def get_recommendation(row, profile_header=None, if_none_match=None):
+    # Read the bundle once: the tag and the body come from the same model version
+    bundle = registry.active
+    if bundle.recommender is None:
+        return not_ready('recommender')
+    # Tagged by model version and row: a revalidating client keeps the (randomly picked)
+    # recommendations it already has until the model changes
+    return _conditional(etag('recommendation', bundle.version, row), f'private, max-age={RECOMMENDATION_MAX_AGE}',
+                        if_none_match, profiler.run, 'get_recommendation', profile_requested(profile_header),
+                        _admitted, 'get_recommendation', (bundle.version, row), _get_recommendation, bundle, row)
+
+
+def _get_recommendation(bundle, row):
+    events, recommender = bundle.events, bundle.recommender
+    if row is None or row < 1 or row > len(events):
+        return {'error': 'Invalid or missing user_id'}, 400
+
+    # Each stage is reported in the Server-Timing header and in /metrics
+    with span('user_lookup'):
+        user_id = events.user_id_at(row - 1)
+    logger.debug("User ID: %s", user_id)
+
+    if user_id is None:
+        return {'error': 'user_id is required'}, 400
+
+    # Fetch user history from the event store
+    with span('history'):
+        user_history = events.user_history(user_id)
+
+    if not user_history:
+        # Cold start: serve the precomputed most popular products
+        key = (bundle.version, None, None)
+        with span('cache'):
+            body = caches['recommendations'].get_or_build(key, _recommendation_body, recommender, None, None)
+    else:
+        # Choose a random product from the user_history
+        random_product = random.choice(user_history)
+        random_viewed_product_id = random_product['product_id']
+        category_code = random_product['category_code']
+
+        # Recommendations for this randomly chosen product (popular ones in its category if it is unknown),
+        # built and encoded once per product and model version
+        key = (bundle.version, random_viewed_product_id, category_code)
+        with span('cache'):
+            body = caches['recommendations'].get_or_build(
+                key, _recommendation_body, recommender, random_viewed_product_id, category_code
+            )
+    return body, 200
+
+
+def _recommendation_body(recommender, product_id, category_code):
+    # Only runs on cache misses, so these spans appear inside 'cache' when it missed
+    with span('recommend'):
+        if product_id is None:
+            recommendations = recommender.get_popular_recommendations(n_recommendations=5)
+        else:
+            recommendations = recommender.get_recommendations(
+                product_id, n_recommendations=5, category_code=category_code
+            )
+    if not recommendations:
+        return {'message': 'No recommendations found for the randomly chosen product'}
+
+    with span('enrich'):
+        for recommendation in recommendations:
+            category_code = recommendation.get('category_code', '').lower()
+            icon_name = icon_defaults.get(category_code, 'device')  # Default to 'device' if not found
+            recommendation['iconName'] = icon_name  # Assign to 'iconName' key
+
+    return {'recommendations': recommendations}
+
+
+def get_warranties(row, profile_header=None, limit=None, cursor=None, stream=False):
+    """
+    All warranties of a user; one page of them when limit or cursor is given
+    ({'warranties': [...], 'next_cursor': ...}); or all of them (from cursor on)
+    streamed as NDJSON, one item per line, when stream is set.
+    limit is the raw query string value.
+    """
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            return {'error': f'limit must be an integer between 1 and {WARRANTY_PAGE_MAX}'}, 400
+    bundle = registry.active
+    if stream:
+        return profiler.run('get_warranties', profile_requested(profile_header),
+                            _stream_warranties, bundle, row, cursor)
+    if limit is None and cursor is None:
+        return profiler.run('get_warranties', profile_requested(profile_header),
+                            _admitted, 'get_warranties', (bundle.version, row), _get_warranties, bundle, row)
+    return profiler.run('get_warranties', profile_requested(profile_header),
+                        _admitted, 'get_warranties', (bundle.version, row, limit, cursor), _get_warranties_page,
+                        bundle, row, limit, cursor)
+
+
+def encode_cursor(version, position, row):
+    """Opaque cursor: model version, position of the next item among the user's events, last log row sent"""
+    return base64.urlsafe_b64encode(f'{version}:{position}:{row}'.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, version):
+    """(position, last row) of a cursor issued for this model version, or None"""
+    try:
+        decoded = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        cursor_version, position, row = decoded.rsplit(':', 2)
+        position, row = int(position), int(row)
+    except ValueError:  # Also covers bad base64 and UTF-8
+        return None
+    return (position, row) if cursor_version == version and position >= 0 else None
+
+
+def _warranty_user(bundle, row):
+    """(user_id, None), or (None, error response)"""
+    events = bundle.events
+    if bundle.recommender is None:
+        return None, not_ready('recommender')
+    if row is None or row < 1 or row > len(events):
+        return None, ({'error': 'Invalid or missing user_id'}, 400)
+    user_id = events.user_id_at(row - 1)
+    logger.debug("Warranty user ID: %s", user_id)
+    if user_id is None:
+        return None, ({'error': 'user_id is required'}, 400)
+    return user_id, None
+
+
+def _get_warranties(bundle, row):
+    user_id, error = _warranty_user(bundle, row)
+    if error:
+        return error
+
+    # Read only this user's events from the store; titles and icons were precomputed at load
+    user_events = bundle.events.user_events(user_id, WARRANTY_COLUMNS)
+    return {'warranties': build_warranties(user_events, user_id, seed=WARRANTY_SEED)}, 200
+
+
+def _start_of(cursor, bundle):
+    """(position, after_row) to resume from, or None for an invalid cursor"""
+    if not cursor:
+        return 0, None
+    return decode_cursor(cursor, bundle.version)
+
+
+def _get_warranties_page(bundle, row, limit, cursor):
+    user_id, error = _warranty_user(bundle, row)
+    if error:
+        return error
+    limit = WARRANTY_PAGE_SIZE if limit is None else limit
+    if not 1 <= limit <= WARRANTY_PAGE_MAX:
+        return {'error': f'limit must be between 1 and {WARRANTY_PAGE_MAX}'}, 400
+    start = _start_of(cursor, bundle)
+    if start is None:
+        return {'error': 'Invalid or expired cursor'}, 400
+    position, after_row = start
+
+    # One extra event tells whether there is a next page
+    user_events = bundle.events.user_events(user_id, ['row', *WARRANTY_COLUMNS], after_row=after_row, limit=limit + 1)
+    page = user_events.iloc[:limit]
+    next_cursor = None
+    if len(user_events) > limit:
+        next_cursor = encode_cursor(bundle.version, position + limit, int(page['row'].iloc[-1]))
+    warranties = build_warranties(page, user_id, seed=WARRANTY_SEED, start=position)
+    return {'warranties': warranties, 'next_cursor': next_cursor}, 200
+
+
+def _stream_warranties(bundle, row, cursor):
+    user_id, error = _warranty_user(bundle, row)
+    if error:
+        return error
+    start = _start_of(cursor, bundle)
+    if start is None:
+        return {'error': 'Invalid or expired cursor'}, 400
+    position, after_row = start
+
+    # The stream holds a slot of its own limiter until it ends or the client goes away,
+    # so slow readers never take slots from get_warranties requests. It also holds the
+    # bundle, so a reload does not close the event store under it
+    limiter = limiters['get_warranties_stream']
+    if not limiter.acquire():
+        return overloaded('get_warranties_stream')
+    bundle.acquire()
+
+    def release():
+        bundle.release()
+        limiter.release()
+
+    def chunks(position):
+        today = datetime.now()  # One reference date for the whole response
+        for user_events in bundle.events.iter_user_events(user_id, WARRANTY_COLUMNS, WARRANTY_STREAM_CHUNK, after_row):
+            yield ndjson_lines(build_warranties(user_events, user_id, seed=WARRANTY_SEED, today=today, start=position))
+            position += len(user_events)
+
+    rest = chunks(position)
+    try:
+        # Built here, so a profiled request's trace covers the first query and encoding
+        first = next(rest, None)
+    except BaseException:
+        release()
+        raise
+
+    def body():
+        if first is not None:
+            yield first
+            yield from rest
+
+    return StreamingBody(body(), on_close=release), 200
@@ -1,155 +1,89 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request
 from flask_cors import CORS
 from data_handler import load_products, analyze_recommendation_potential, remove_rows_with_missing, process_csv, count_rows_with_missing
-from predict_algorithms.trie.generate_trie import load_trie
 from predict_algorithms.products.testReccomender import load_and_test_recommender, load_csv_data_and_test_recommender
-from predict_algorithms.products.productRecommender import ProductRecommender
-import pandas as pd
-from datetime import datetime, timedelta
-import random
+import api
+from api import registry
+from metrics import span, start_timings, stop_timings
+from profiling import PROFILE_HEADER
+from serialization import EncodedBody, StreamingBody
+import time
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
-# Load product data and initialize trie
-folder_path = 'data_sets/words_prediction_datasets'
-products = load_products(folder_path)
-unique_prods = sorted(list(set(products)))
-trie = load_trie(unique_prods)
-
-
-data_file_path = 'data_sets/recommendation_sys_datasets/buying_users.csv'
-df = pd.read_csv(data_file_path)
-recommender = ProductRecommender()
-recommender.fit(df)
-
-icon_defaults = {
-    "cpu": "chip",
-    "gpu": "chip",
-    "soundcard": "developer-board",
-    "sound_card": "developer-board",
-    'videocards':"developer-board",
-    "motherboard": "developer-board",
-    "ram": "memory",
-    "storage": "storage_icon",
-    "network": "network_icon",
-    "power": "power_icon",
-    "cartrige":"printer",
-    "hdd":"harddisk",
-
-}
+def respond(body, status, headers=None):
+    if status == 304:
+        return Response(status=304, headers=headers)
+    if isinstance(body, StreamingBody):
+        # Werkzeug sends each chunk as it is produced and closes the body at the end
+        return Response(body, status, headers=headers, content_type=body.content_type)
+    # Cached responses arrive already encoded and gzipped; others are encoded (and gzipped when accepted) here
+    with span('serialize'):
+        body = EncodedBody.of(body)
+        data, encoding = body.for_client(request.headers.get('Accept-Encoding'))
+    response = Response(data, status, headers=headers, content_type=body.content_type)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+    start_timings()
+
+@app.after_request
+def record_request(response):
+    timings = stop_timings()
+    if timings and timings.spans:
+        response.headers['Server-Timing'] = timings.header()
+    # Label by route rule, not raw path, so arbitrary URLs don't create new series
+    route = request.url_rule.rule if request.url_rule else 'other'
+    api.request_metrics.observe(route, time.perf_counter() - g.request_start, response.status_code, timings)
+    return response
 
 @app.route('/autocomplete', methods=['GET'])
 def autocomplete():
-    query = request.args.get('query', '').lower()
-    if not query:
-        return jsonify([])
-    
-    # Get suggestions from trie
-    suggestions = trie.autocomplete(query, max_suggestions=5)
-    
-    return jsonify(suggestions)
+    return respond(*api.autocomplete(request.args.get('query', ''), request.headers.get('If-None-Match')))
 
 @app.route('/health', methods=['GET'])
 def health():
-    return "Python server is running!"
+    return respond(*api.health())
 
-@app.route('/get_recommendation', methods=['GET']) 
-def get_recommendation():
-    row = request.args.get('user_id', type=int)
-    if row is None or row < 1 or row > len(df):
-        return jsonify({'error': 'Invalid or missing user_id'}), 400
+@app.route('/ready', methods=['GET'])
+def ready():
+    return respond(*api.ready())
 
-    user_id = df.loc[row - 1, 'user_id']
-    print(f"User ID: {user_id}")
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return respond(*api.metrics())
 
-    if user_id is None:
-        return jsonify({'error': 'user_id is required'}), 400
+@app.route('/admin/reload', methods=['POST'])
+def reload_models():
+    version = request.args.get('version') or (request.get_json(silent=True) or {}).get('version')
+    return respond(*api.reload_models(version, request.headers.get('X-Admin-Token')))
 
-    # Fetch user history from your recommender
-    user_history = recommender.get_user_history(user_id)
+@app.route('/admin/profiles', methods=['GET'])
+def list_profiles():
+    return respond(*api.list_profiles(request.headers.get('X-Admin-Token')))
 
-    if not user_history:
-        return jsonify({'message': 'No user history found'}), 200
+@app.route('/admin/profiles/<name>', methods=['GET'])
+def get_profile(name):
+    return respond(*api.get_profile(name, request.headers.get('X-Admin-Token'),
+                                    request.args.get('format', 'text'), request.args.get('sort', 'cumulative')))
 
-    # Choose a random product from the user_history
-    random_product = random.choice(user_history)
-    random_viewed_product_id = random_product['product_id']
-
-    # Get recommendations for this randomly chosen product
-    recommendations = recommender.get_recommendations(random_viewed_product_id, n_recommendations=5)
-    if not recommendations:
-        return jsonify({'message': 'No recommendations found for the randomly chosen product'}), 200
-    
-    for recommendation in recommendations:
-        category_code = recommendation.get('category_code', '').lower()
-        icon_name = icon_defaults.get(category_code, 'device')  # Default to 'device' if not found
-        recommendation['iconName'] = icon_name  # Assign to 'iconName' key
-    
-    # Return the recommendations as a JSON response
-    return jsonify({'recommendations': recommendations}), 200
+@app.route('/get_recommendation', methods=['GET']) 
+def get_recommendation():
+    return respond(*api.get_recommendation(request.args.get('user_id', type=int), request.headers.get(PROFILE_HEADER),
+                                           request.headers.get('If-None-Match')))
 
-    
 @app.route('/get_warranties', methods=['GET'])
 def get_warranties():
-    row = request.args.get('user_id', type=int)
-    user_id = df.loc[row - 1, 'user_id']
-    print(user_id)
-    if user_id is None:
-        return jsonify({'error': 'user_id is required'}), 400
-    
-    # Filter events for the given user_id
-    user_events = df[df['user_id'] == user_id]
-    
-    warranties = []
-    today = datetime.now()
-    
-    for _, event in user_events.iterrows():
-        # Extract last word from category_code
-        category_code = event['category_code']
-        title = category_code.split('.')[-1] if '.' in category_code else category_code
-        
-        # Subtitle is the brand
-        subtitle = event['brand']
-        
-        # Generate a random date within the last year
-        random_days = random.randint(0, 365)
-        warranty_date = today - timedelta(days=random_days)
-        date_str = warranty_date.strftime('%d/%m/%Y')
-        
-        # Calculate timeAgo
-        days_diff = (today - warranty_date).days
-        if days_diff < 30:
-            timeAgo = f"{days_diff} days ago"
-        elif days_diff < 365:
-            months = days_diff // 30
-            timeAgo = f"in {months} months" if random.choice([True, False]) else f"{months} months ago"
-        else:
-            years = days_diff // 365
-            timeAgo = f"{years} year ago" if years == 1 else f"{years} years ago"
-        
-        # Icon name based on title (assuming iconName matches title)
-        iconName = title.lower()
-        if iconName in icon_defaults:
-            iconName = icon_defaults[iconName]
-        
-        
-        # Calculate progress percentage (0% to 100%)
-        progress = (days_diff / 365) * 100
-        progress = min(max(progress, 0), 100)  # Ensure progress is between 0 and 100
-        
-        warranty_item = {
-            'title': title,
-            'subtitle': subtitle,
-            'date': date_str,
-            'timeAgo': timeAgo,
-            'iconName': iconName,
-            'progress': progress,  # Represented as a percentage (0 to 100)
-        }
-        
-        warranties.append(warranty_item)
-    
-    return jsonify({'warranties': warranties})
+    # ?limit=&cursor= for pages, ?format=ndjson to stream the items
+    return respond(*api.get_warranties(request.args.get('user_id', type=int), request.headers.get(PROFILE_HEADER),
+                                       request.args.get('limit'), request.args.get('cursor'),
+                                       request.args.get('format') == 'ndjson'))
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,303 @@
+"""
+ASGI version of the API, for many concurrent clients in one process.
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+    python asgi_app.py --benchmark
+
+The event loop only parses requests, applies the concurrency limit and writes
+responses; the handlers in api.py (trie, event store, recommender) run in a
+bounded thread pool, so a slow recommendation never blocks other requests.
+When MAX_PENDING requests are already waiting for the pool, new ones get 503
+right away instead of queueing without bound.
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import api
+from metrics import span, start_timings, stop_timings
+from profiling import PROFILE_HEADER
+from serialization import EncodedBody, StreamingBody, dumps, loads
+
+MODEL_THREADS = int(os.environ.get('MODEL_THREADS', str(min(32, (os.cpu_count() or 1) + 4))))
+MAX_PENDING = int(os.environ.get('MAX_PENDING', '256'))
+PROFILES_PREFIX = '/admin/profiles/'
+# flask_cors' defaults, which app.py uses: any origin, these methods, any requested headers
+CORS_METHODS = b'DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT'
+
+
+def _int_arg(params, name):
+    try:
+        return int(params[name][0])
+    except (KeyError, ValueError):
+        return None
+
+
+def _cors_headers(headers, preflight=False):
+    """Access-Control-* response headers, as flask_cors sends them for this request"""
+    origin = headers.get('origin')
+    if not origin:
+        return [(b'access-control-allow-origin', b'*')]
+    cors = [(b'access-control-allow-origin', origin.encode('latin-1')), (b'vary', b'Origin')]
+    if preflight and 'access-control-request-method' in headers:
+        cors.append((b'access-control-allow-methods', CORS_METHODS))
+        if headers.get('access-control-request-headers'):
+            cors.append((b'access-control-allow-headers', headers['access-control-request-headers'].encode('latin-1')))
+    return cors
+
+
+def _with_headers(response):
+    """(body, status, [(name, value) bytes pairs]) of a handler's (body, status[, headers dict])"""
+    body, status, *headers = response
+    headers = headers[0] if headers else {}
+    return body, status, [(name.lower().encode(), value.encode()) for name, value in headers.items()]
+
+
+class AsyncApi:
+    """Raw ASGI application routing to the api.py handlers"""
+    def __init__(self, model_threads=MODEL_THREADS, max_pending=MAX_PENDING):
+        self.executor = ThreadPoolExecutor(max_workers=model_threads, thread_name_prefix='model')
+        self.max_pending = max_pending
+        self.pending = 0  # Only touched on the event loop
+        # Cheap handlers answer on the loop; the rest go to the executor
+        self.routes = {
+            ('GET', '/health'): (False, lambda params, body, headers: api.health()),
+            ('GET', '/ready'): (False, lambda params, body, headers: api.ready()),
+            ('GET', '/metrics'): (False, lambda params, body, headers: api.metrics()),
+            ('GET', '/autocomplete'): (True, lambda params, body, headers: api.autocomplete(
+                params.get('query', [''])[0], headers.get('if-none-match'))),
+            ('GET', '/get_recommendation'): (True, lambda params, body, headers: api.get_recommendation(
+                _int_arg(params, 'user_id'), headers.get(PROFILE_HEADER.lower()), headers.get('if-none-match'))),
+            ('GET', '/get_warranties'): (True, lambda params, body, headers: api.get_warranties(
+                _int_arg(params, 'user_id'), headers.get(PROFILE_HEADER.lower()), params.get('limit', [None])[0],
+                params.get('cursor', [None])[0], params.get('format', [None])[0] == 'ndjson')),
+            ('POST', '/admin/reload'): (False, self._reload),
+            ('GET', '/admin/profiles'): (True, lambda params, body, headers: api.list_profiles(
+                headers.get('x-admin-token'))),
+            ('GET', '/admin/profiles/<name>'): (True, lambda params, body, headers: api.get_profile(
+                params['name'][0], headers.get('x-admin-token'),
+                params.get('format', ['text'])[0], params.get('sort', ['cumulative'])[0])),
+        }
+
+    @staticmethod
+    def route_of(path):
+        """Route pattern of a request path (the only parameterized route is a saved profile)"""
+        if path.startswith(PROFILES_PREFIX) and len(path) > len(PROFILES_PREFIX):
+            return PROFILES_PREFIX + '<name>'
+        return path
+
+    @staticmethod
+    def _reload(params, body, headers):
+        version = params.get('version', [None])[0]
+        if not version and body:
+            try:
+                version = (loads(body) or {}).get('version')
+            except (ValueError, AttributeError):  # orjson.JSONDecodeError is a ValueError
+                version = None
+        return api.reload_models(version, headers.get('x-admin-token'))
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        start = time.perf_counter()
+        status, timings = 500, None
+        try:
+            status, timings = await self._handle(scope, receive, send)
+        finally:
+            api.request_metrics.observe(self.route_of(scope['path']), time.perf_counter() - start, status, timings)
+
+    async def _handle(self, scope, receive, send):
+        """Answer one HTTP request, returning the response status and the handler's stage timings"""
+        path = scope['path']
+        headers = {key.decode('latin-1').lower(): value.decode('latin-1') for key, value in scope['headers']}
+        if scope['method'] == 'OPTIONS':
+            return await self._options(send, path, headers), None
+        cors = _cors_headers(headers)
+        route = self.routes.get((scope['method'], self.route_of(path)))
+        if route is None:
+            return await self._send_json(send, {'error': 'Not found'}, 404, cors), None
+        offload, handler = route
+        params = parse_qs(scope['query_string'].decode('latin-1'), keep_blank_values=True)
+        if path.startswith(PROFILES_PREFIX):
+            params['name'] = [path[len(PROFILES_PREFIX):]]
+        body = await self._read_body(receive) if scope['method'] == 'POST' else b''
+
+        accept_encoding = headers.get('accept-encoding')
+        if not offload:
+            result, status, response_headers = _with_headers(handler(params, body, headers))
+            result = EncodedBody.of(result)
+            return await self._send(send, *result.for_client(accept_encoding), result.content_type, status,
+                                    cors + response_headers), None
+        if self.pending >= self.max_pending:
+            return await self._send_json(send, {'error': 'Server is busy, try again later'}, 503, cors), None
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            # Encode and compress in the pool too, so large payloads don't hold up the loop
+            result, status, response_headers, timings = await loop.run_in_executor(
+                self.executor, self._call, handler, params, body, headers, accept_encoding
+            )
+        finally:
+            self.pending -= 1
+        response_headers = cors + response_headers
+        if timings.spans:
+            response_headers.append((b'server-timing', timings.header().encode()))
+        if status == 304:
+            return await self._send(send, b'', None, None, status, response_headers), timings
+        if isinstance(result, StreamingBody):
+            return await self._stream(send, result, status, response_headers), timings
+        content_type, payload, encoding = result
+        return await self._send(send, payload, encoding, content_type, status, response_headers), timings
+
+    async def _options(self, send, path, headers):
+        """CORS preflight (or plain OPTIONS) answer for a path, like Flask's automatic OPTIONS routes"""
+        route = self.route_of(path)
+        methods = [method for method, route_path in self.routes if route_path == route]
+        cors = _cors_headers(headers, preflight=True)
+        if not methods:
+            return await self._send_json(send, {'error': 'Not found'}, 404, cors)
+        allow = ', '.join(['OPTIONS', *methods]).encode()
+        return await self._send(send, b'', None, None, 200, [(b'allow', allow), *cors])
+
+    @staticmethod
+    def _call(handler, params, body, headers, accept_encoding):
+        """
+        Run a handler in the executor. Returns its result as (content type, bytes,
+        content encoding) unless it is a 304 or a StreamingBody, plus the status,
+        headers and timings.
+        """
+        # Spans are collected per thread, so timing starts here in the executor thread
+        start_timings()
+        try:
+            result, status, response_headers = _with_headers(handler(params, body, headers))
+            if status != 304 and not isinstance(result, StreamingBody):
+                with span('serialize'):
+                    result = EncodedBody.of(result)
+                    result = (result.content_type, *result.for_client(accept_encoding))
+        finally:
+            timings = stop_timings()
+        return result, status, response_headers, timings
+
+    async def _stream(self, send, body, status, extra_headers):
+        """Send a StreamingBody, producing each chunk in the executor"""
+        headers = [(b'content-type', body.content_type.encode()), *extra_headers]
+        loop = asyncio.get_running_loop()
+        try:
+            await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+            while True:
+                chunk = await loop.run_in_executor(self.executor, next, body, None)
+                if chunk is None:
+                    break
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            body.close()  # Also when the client disconnected mid-stream
+        return status
+
+    @staticmethod
+    async def _read_body(receive):
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    async def _send_json(self, send, body, status, extra_headers=()):
+        return await self._send(send, dumps(body), None, 'application/json', status, extra_headers)
+
+    @staticmethod
+    async def _send(send, payload, encoding, content_type, status, extra_headers=()):
+        headers = [(b'content-length', str(len(payload)).encode()), *extra_headers]
+        if content_type:
+            headers.append((b'content-type', content_type.encode()))
+        if encoding:
+            headers += [(b'content-encoding', encoding.encode()), (b'vary', b'Accept-Encoding')]
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': payload})
+        return status
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+app = AsyncApi()
+
+
+def _start_server(command, port):
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # Wait for the models, not just the socket
+    deadline = time.time() + 300
+    while time.time() < deadline:
+        try:
+            import http.client
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', '/ready')
+            if conn.getresponse().status == 200:
+                return process
+        except OSError:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"Server did not become ready: {' '.join(command)}")
+
+
+def run_benchmark(path, concurrency_levels, requests, port=5090):
+    """
+    Requests/sec, errors and p99 latency of the Flask app (threaded WSGI server, one process)
+    and this ASGI app (uvicorn, one process) at each concurrency level.
+    """
+    from serve import benchmark
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    servers = {
+        'flask': [sys.executable, '-c',
+                  f"import sys; sys.path.insert(0, {here!r}); import logging; "
+                  f"logging.getLogger('werkzeug').setLevel(logging.WARNING); from app import app; "
+                  f"app.run(host='127.0.0.1', port={port}, threaded=True)"],
+        'asgi': [sys.executable, '-m', 'uvicorn', '--app-dir', here, '--port', str(port),
+                 '--log-level', 'warning', '--no-access-log', 'asgi_app:app'],
+    }
+    results = {}
+    for name, command in servers.items():
+        process = _start_server(command, port)
+        try:
+            for concurrency in concurrency_levels:
+                rate, errors, p99 = benchmark('127.0.0.1', port, path, requests, concurrency)
+                results[(name, concurrency)] = (rate, errors, p99)
+                print(f"{name}: {concurrency} concurrent clients, {rate:.0f} requests/sec, "
+                      f"p99 {p99:.0f}ms ({errors} errors)")
+        finally:
+            process.terminate()
+            process.wait()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--benchmark', action='store_true')
+    parser.add_argument('--path', default='/get_recommendation?user_id=1')
+    parser.add_argument('--concurrency', default='1,16,64,256', help="Comma-separated concurrency levels")
+    parser.add_argument('--requests', type=int, default=1000)
+    args = parser.parse_args()
+    if args.benchmark:
+        run_benchmark(args.path, [int(c) for c in args.concurrency.split(',')], args.requests)
+    else:
+        import uvicorn
+        uvicorn.run('asgi_app:app', host='0.0.0.0', port=5000)
@@ -0,0 +1,141 @@
+import os
+import sqlite3
+import threading
+
+import pandas as pd
+
+HISTORY_COLUMNS = ['product_id', 'category_id', 'category_code', 'brand']
+
+
+class EventStore:
+    """
+    Read-only, on-disk view of the events log in SQLite.
+
+    Events keep their CSV row number as primary key and are indexed by
+    user_id, so request handlers fetch only the rows of one user instead of
+    keeping the whole log in a DataFrame. Each thread gets its own
+    connection; the file itself is shared through the OS page cache.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []  # Every thread's connection, so close() can reach them all
+        self._lock = threading.Lock()
+        self.n_events = self._connection().execute('SELECT COUNT(*) FROM events').fetchone()[0]
+
+    @classmethod
+    def build(cls, frames, path):
+        """
+        Write events to a new store at path and open it.
+
+        Args:
+            frames: DataFrames with the events, in row order (e.g. pd.read_csv(..., chunksize=...))
+            path (str): Database file; replaced atomically once complete
+        """
+        if isinstance(frames, pd.DataFrame):
+            frames = [frames]
+        tmp_path = path + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        with sqlite3.connect(tmp_path) as conn:
+            start = 0
+            for frame in frames:
+                frame = frame.set_axis(pd.RangeIndex(start, start + len(frame), name='row'))
+                frame.to_sql('events', conn, if_exists='append', index=True)
+                start += len(frame)
+            conn.execute('CREATE INDEX IF NOT EXISTS events_user_id ON events (user_id)')
+        conn.close()
+        os.replace(tmp_path, path)  # Never expose a half-written store
+        return cls(path)
+
+    @classmethod
+    def from_csv(cls, csv_path, path, chunk_size=100_000, transform=None):
+        """
+        Build a store from an events CSV without loading it into memory at once.
+
+        Args:
+            transform (callable, optional): Applied to each chunk DataFrame before it is written
+        """
+        frames = pd.read_csv(csv_path, chunksize=chunk_size)
+        if transform is not None:
+            frames = (transform(frame) for frame in frames)
+        return cls.build(frames, path)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Only used by this thread, but close() may close it from another one
+            conn = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True, check_same_thread=False)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        """Close the connections of every thread, e.g. before the file is deleted"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+
+    def __len__(self):
+        return self.n_events
+
+    def __getstate__(self):
+        return {'path': self.path}  # Connections are per process and thread
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def user_id_at(self, row):
+        """user_id of the event at a 0-based row, or None when out of range"""
+        result = self._connection().execute('SELECT user_id FROM events WHERE "row" = ?', (int(row),)).fetchone()
+        return result[0] if result else None
+
+    def user_events(self, user_id, columns=None, after_row=None, limit=None):
+        """
+        DataFrame with the events of one user, in log order.
+
+        Args:
+            user_id: User whose events are read
+            columns (list, optional): Columns to read (all by default; "row" is the log row)
+            after_row (int, optional): Only events after this log row (keyset pagination)
+            limit (int, optional): At most this many events
+        """
+        selected = ', '.join(f'"{column}"' for column in columns) if columns else '*'
+        query = f'SELECT {selected} FROM events WHERE user_id = ?'
+        params = [_to_sql_value(user_id)]
+        if after_row is not None:
+            query += ' AND "row" > ?'
+            params.append(int(after_row))
+        query += ' ORDER BY "row"'
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(int(limit))
+        return pd.read_sql_query(query, self._connection(), params=params)
+
+    def iter_user_events(self, user_id, columns, chunk_size=1000, after_row=None):
+        """
+        The events of one user in DataFrames of at most chunk_size rows.
+
+        Each chunk is its own query, so memory stays bounded and the chunks may
+        be read from different threads (connections are per thread).
+        """
+        columns = ['row', *[column for column in columns if column != 'row']]
+        while True:
+            chunk = self.user_events(user_id, columns, after_row=after_row, limit=chunk_size)
+            if chunk.empty:
+                return
+            yield chunk
+            if len(chunk) < chunk_size:
+                return
+            after_row = int(chunk['row'].iloc[-1])
+
+    def user_history(self, user_id):
+        """Distinct products of a user, like ProductRecommender.get_user_history"""
+        events = self.user_events(user_id, HISTORY_COLUMNS).drop_duplicates(subset=['product_id'])
+        return events.to_dict('records')
+
+
+def _to_sql_value(value):
+    return value.item() if hasattr(value, 'item') else value  # NumPy scalars -> Python
@@ -0,0 +1,178 @@
+"""
+Request metrics in the Prometheus text exposition format.
+
+Each route has a fixed set of counters and a latency histogram; recording a
+request is a bucket search outside the lock plus a few integer increments
+under a per-route lock, so it can stay on in production. Gauges (cache
+ratios, model sizes, load times) are read from the live objects at scrape
+time rather than tracked on the request path.
+
+Handlers mark their stages with span(); the stages of one request are
+returned in its Server-Timing header and aggregated per route and stage.
+
+With the prefork server every worker keeps its own counters; a scrape sees
+the worker that answered it.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds of the latency buckets in seconds (+Inf is implicit)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RouteStats:
+    """Request/error counts and latency histogram of one route"""
+    __slots__ = ('lock', 'requests', 'errors', 'buckets', 'latency_sum')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+
+    def observe(self, seconds, status):
+        bucket = bisect_left(LATENCY_BUCKETS, seconds)
+        with self.lock:
+            self.requests += 1
+            self.errors += status >= 500
+            self.buckets[bucket] += 1
+            self.latency_sum += seconds
+
+    def snapshot(self):
+        with self.lock:
+            return self.requests, self.errors, list(self.buckets), self.latency_sum
+
+
+class Timings:
+    """Stage durations of one request, in the order the stages finished"""
+    __slots__ = ('spans',)
+
+    def __init__(self):
+        self.spans = []
+
+    def header(self):
+        """Server-Timing header value, durations in milliseconds"""
+        return ', '.join(f'{name};dur={seconds * 1000:.2f}' for name, seconds in self.spans)
+
+
+_current = threading.local()
+
+
+def start_timings():
+    """Collect the spans of the request running on this thread"""
+    _current.timings = Timings()
+    return _current.timings
+
+
+def stop_timings():
+    timings = getattr(_current, 'timings', None)
+    _current.timings = None
+    return timings
+
+
+@contextmanager
+def span(name):
+    """Time a stage of the current request (a no-op outside start_timings/stop_timings)"""
+    timings = getattr(_current, 'timings', None)
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.spans.append((name, time.perf_counter() - start))
+
+
+class Metrics:
+    """Per-route request stats, for a fixed set of route names"""
+    def __init__(self, routes):
+        self.started = time.time()
+        # Unknown paths share one series so clients can't grow the label set
+        self.routes = {route: RouteStats() for route in (*routes, 'other')}
+        self.stages = {}  # (route, stage) -> RouteStats; stage names are fixed in the code
+        self._stages_lock = threading.Lock()
+
+    def observe(self, route, seconds, status, timings=None):
+        if route not in self.routes:
+            route = 'other'
+        self.routes[route].observe(seconds, status)
+        for stage, stage_seconds in (timings.spans if timings else ()):
+            stats = self.stages.get((route, stage))
+            if stats is None:
+                with self._stages_lock:
+                    stats = self.stages.setdefault((route, stage), RouteStats())
+            stats.observe(stage_seconds, 0)
+
+    def render(self, gauges=()):
+        """
+        Exposition text of the route stats plus values read at scrape time.
+
+        Args:
+            gauges: (name, help, [(labels dict, value), ...]) tuples, optionally
+                followed by the metric type ('gauge' by default, or 'counter')
+        """
+        lines = [
+            '# HELP http_requests_total Requests handled, by route',
+            '# TYPE http_requests_total counter',
+        ]
+        snapshots = {route: stats.snapshot() for route, stats in self.routes.items()}
+        for route, (requests, _, _, _) in snapshots.items():
+            lines.append(f'http_requests_total{{route="{route}"}} {requests}')
+        lines += [
+            '# HELP http_request_errors_total Requests answered with a 5xx status, by route',
+            '# TYPE http_request_errors_total counter',
+        ]
+        for route, (_, errors, _, _) in snapshots.items():
+            lines.append(f'http_request_errors_total{{route="{route}"}} {errors}')
+        lines += [
+            '# HELP http_request_duration_seconds Request latency, by route',
+            '# TYPE http_request_duration_seconds histogram',
+        ]
+        for route, snapshot in snapshots.items():
+            lines += _histogram_lines('http_request_duration_seconds', f'route="{route}"', snapshot)
+        lines += [
+            '# HELP http_request_stage_duration_seconds Duration of each request stage, by route',
+            '# TYPE http_request_stage_duration_seconds histogram',
+        ]
+        for (route, stage), stats in list(self.stages.items()):
+            lines += _histogram_lines('http_request_stage_duration_seconds', f'route="{route}",stage="{stage}"',
+                                      stats.snapshot())
+
+        gauges = [('process_uptime_seconds', 'Seconds since the metrics were created',
+                   [({}, time.time() - self.started)]), *gauges]
+        for name, help_text, samples, *kind in gauges:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind[0] if kind else "gauge"}']
+            for labels, value in samples:
+                lines.append(f'{name}{_labels(labels)} {_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _histogram_lines(name, labels, snapshot):
+    requests, _, buckets, latency_sum = snapshot
+    lines, cumulative = [], 0
+    for bound, count in zip((*LATENCY_BUCKETS, '+Inf'), buckets):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_sum{{{labels}}} {latency_sum}')
+    lines.append(f'{name}_count{{{labels}}} {requests}')
+    return lines
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + '}'
+
+
+def _value(value):
+    if value is None:
+        return 'NaN'
+    return repr(float(value))
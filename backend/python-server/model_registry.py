@@ -0,0 +1,438 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from data_handler import load_products
+from event_store import EventStore
+from warranties import add_warranty_columns
+from predict_algorithms.trie.generate_trie import load_trie
+from predict_algorithms.products.productRecommender import ProductRecommender
+from predict_algorithms.products.similarityShards import ShardCluster, build_shards
+
+PRODUCTS_FOLDER = 'data_sets/words_prediction_datasets'
+EVENTS_PATH = 'data_sets/recommendation_sys_datasets/buying_users.csv'
+ARTIFACTS_DIR = 'data_sets/recommendation_sys_datasets/artifacts'
+COMPONENTS = ('trie', 'recommender')  # Parts of a bundle that become ready independently
+RETIRE_DELAY_SECONDS = 30  # Grace period before a replaced bundle closes (later while streams still read it)
+KEEP_VERSIONS = int(os.environ.get('KEEP_MODEL_VERSIONS', '5'))  # Saved artifacts kept for rollback
+FIT_COLUMNS = ('user_id', 'product_id', 'category_id', 'category_code', 'brand')  # Read by ProductRecommender
+
+
+class ModelBundle:
+    """
+    Everything the request handlers read: the autocomplete trie, the on-disk
+    event store and the fitted recommender, built together under one version.
+    """
+    def __init__(self, version, trie, events, recommender):
+        self.version = version
+        self.trie = trie
+        self.events = events
+        self.recommender = recommender
+        self.loaded_at = datetime.now().isoformat(timespec='seconds')
+        self._init_readers()
+
+    def _init_readers(self):
+        self._readers = 0  # Streams still reading the bundle (see acquire)
+        self._on_idle = None
+        self._readers_lock = threading.Lock()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        for key in ('_readers', '_on_idle', '_readers_lock'):
+            state.pop(key, None)  # Readers are per process
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_readers()
+
+    def acquire(self):
+        """Keep the bundle open for a reader that outlives its request handler, until release()"""
+        with self._readers_lock:
+            self._readers += 1
+
+    def release(self):
+        with self._readers_lock:
+            self._readers -= 1
+            on_idle = self._on_idle if self._readers == 0 else None
+            if on_idle is not None:
+                self._on_idle = None
+        if on_idle is not None:
+            on_idle()
+
+    def when_idle(self, callback):
+        """Run callback now if no reader holds the bundle, otherwise when the last one releases it"""
+        with self._readers_lock:
+            if self._readers:
+                self._on_idle = callback
+                return
+        callback()
+
+    def close(self):
+        """Close the event store connections and stop the similarity shard processes, if any"""
+        if self.events is not None:
+            self.events.close()
+        service = getattr(self.recommender, 'similarity_service', None)
+        if service is not None:
+            service.close()
+
+
+def bundle_files(bundle):
+    """Absolute paths of the artifact files a bundle reads while it serves"""
+    files = []
+    if bundle.events is not None:
+        files.append(os.path.abspath(bundle.events.path))
+    service = getattr(bundle.recommender, 'similarity_service', None)
+    if service is not None:
+        files.append(os.path.abspath(service.path))
+    return files
+
+
+def build_trie(products_folder=PRODUCTS_FOLDER):
+    """Autocomplete trie over the product names"""
+    products = load_products(products_folder)
+    unique_prods = sorted(list(set(products)))
+    return load_trie(unique_prods)
+
+
+def event_store_path(events_path=EVENTS_PATH, artifacts_dir=ARTIFACTS_DIR):
+    """Store path named after the events CSV's path, size and modification time"""
+    stat = os.stat(events_path)
+    source = f'{os.path.abspath(events_path)}:{stat.st_size}:{stat.st_mtime_ns}'
+    return os.path.join(artifacts_dir, f'events-{hashlib.blake2b(source.encode(), digest_size=8).hexdigest()}.sqlite')
+
+
+def open_event_store(events_path=EVENTS_PATH, artifacts_dir=ARTIFACTS_DIR):
+    """The event store of the events CSV, built chunk by chunk unless an unchanged CSV already has one"""
+    os.makedirs(artifacts_dir, exist_ok=True)
+    path = event_store_path(events_path, artifacts_dir)
+    if os.path.exists(path):
+        print(f"Reusing event store {path}")
+        return EventStore(path)
+    return EventStore.from_csv(events_path, path, transform=add_warranty_columns)
+
+
+def build_recommendation(version, events_path=EVENTS_PATH, artifacts_dir=ARTIFACTS_DIR, n_shards=0,
+                         precision='float64'):
+    """
+    Event store and fitted ProductRecommender for a version.
+    With n_shards, the product similarity matrix is partitioned across that many
+    shard processes instead of being held in this one. precision is the storage
+    precision of the in-process product vectors (shards keep their own float32 rows).
+    """
+    events = open_event_store(events_path, artifacts_dir)
+    # Only the fitted columns, and only for fitting; requests read the events from the store
+    df = pd.read_csv(events_path, usecols=lambda column: column in FIT_COLUMNS)
+    recommender = ProductRecommender(keep_events=False, precision=precision)
+    if n_shards:
+        shards_path = os.path.join(artifacts_dir, f'{version}-shards')
+        build_shards(df, n_shards, shards_path)
+        recommender.fit_sharded(df, ShardCluster(shards_path))
+    else:
+        recommender.fit(df)
+    return events, recommender
+
+
+_last_version_time = None
+_version_lock = threading.Lock()
+
+
+def new_version():
+    """
+    Unique, sortable version: the time to the microsecond, moved past the last
+    version handed out when the clock has not advanced (or went back)
+    """
+    global _last_version_time
+    with _version_lock:
+        now = datetime.now()
+        if _last_version_time is not None and now <= _last_version_time:
+            now = _last_version_time + timedelta(microseconds=1)
+        _last_version_time = now
+    return now.strftime('%Y%m%d-%H%M%S-%f')
+
+
+def build_bundle(products_folder=PRODUCTS_FOLDER, events_path=EVENTS_PATH, version=None,
+                 artifacts_dir=ARTIFACTS_DIR, n_shards=0, precision='float64'):
+    """Build a complete bundle from the source datasets"""
+    version = version or new_version()
+    if os.path.exists(os.path.join(artifacts_dir, f'{version}.pkl')):
+        # Its artifact, shards, ETags and cursors would be confused with the existing build's
+        raise ValueError(f"Model version {version} already exists")
+    trie = build_trie(products_folder)
+    events, recommender = build_recommendation(version, events_path, artifacts_dir, n_shards, precision)
+    return ModelBundle(version, trie, events, recommender)
+
+
+def save_bundle(bundle, artifacts_dir=ARTIFACTS_DIR):
+    """
+    Write a bundle as the versioned artifact <artifacts_dir>/<version>.pkl, with
+    <version>.json listing the files it reads (kept while the artifact is)
+    """
+    os.makedirs(artifacts_dir, exist_ok=True)
+    with open(os.path.join(artifacts_dir, f'{bundle.version}.json'), 'w', encoding='utf-8') as f:
+        json.dump({'files': bundle_files(bundle)}, f)
+    path = os.path.join(artifacts_dir, f'{bundle.version}.pkl')
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(bundle, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)  # Never expose a half-written artifact
+    return path
+
+
+def saved_versions(artifacts_dir=ARTIFACTS_DIR):
+    """Versions with a saved artifact, newest first"""
+    if not os.path.isdir(artifacts_dir):
+        return []
+    return sorted((name[:-len('.pkl')] for name in os.listdir(artifacts_dir) if name.endswith('.pkl')), reverse=True)
+
+
+def prune_artifacts(artifacts_dir=ARTIFACTS_DIR, keep=KEEP_VERSIONS):
+    """Delete all but the `keep` newest saved artifacts"""
+    for version in saved_versions(artifacts_dir)[keep:]:
+        os.remove(os.path.join(artifacts_dir, f'{version}.pkl'))
+        try:
+            os.remove(os.path.join(artifacts_dir, f'{version}.json'))
+        except FileNotFoundError:
+            pass
+
+
+def remove_unused_files(artifacts_dir=ARTIFACTS_DIR, in_use=()):
+    """
+    Delete the event stores and similarity shard directories in artifacts_dir
+    that no saved artifact lists and that are not in `in_use` (the files of the
+    bundles still serving)
+    """
+    keep = set(in_use)
+    for version in saved_versions(artifacts_dir):
+        try:
+            with open(os.path.join(artifacts_dir, f'{version}.json'), 'r', encoding='utf-8') as f:
+                keep.update(json.load(f)['files'])
+        except FileNotFoundError:
+            pass
+    for name in os.listdir(artifacts_dir):
+        path = os.path.abspath(os.path.join(artifacts_dir, name))
+        if path in keep:
+            continue
+        if name.startswith('events-') and name.endswith('.sqlite'):
+            os.remove(path)
+            print(f"Removed unused event store {path}")
+        elif name.endswith('-shards') and os.path.isdir(path):
+            # Retired bundles' shard processes have exited by now (ModelBundle.close joins them)
+            shutil.rmtree(path)
+            print(f"Removed unused similarity shards {path}")
+
+
+def load_bundle(version, artifacts_dir=ARTIFACTS_DIR):
+    """Load the versioned artifact written by save_bundle"""
+    if os.path.basename(version) != version:
+        raise ValueError(f"Invalid model version: {version}")
+    with open(os.path.join(artifacts_dir, f'{version}.pkl'), 'rb') as f:
+        return pickle.load(f)
+
+
+class ModelRegistry:
+    """
+    Holds the active ModelBundle and swaps in new ones.
+
+    New bundles are built or loaded off to the side (optionally in a background
+    thread) and activated with a single reference assignment. Handlers read
+    ``registry.active`` once per request, so requests in flight keep using the
+    bundle they started with; streams that may outlast the retirement grace
+    period also hold it with ModelBundle.acquire().
+    """
+    def __init__(self, artifacts_dir=ARTIFACTS_DIR, n_shards=0, precision='float64'):
+        self.artifacts_dir = artifacts_dir
+        self.n_shards = n_shards
+        self.precision = precision
+        self._active = None
+        self._load_lock = threading.Lock()
+        self._retiring = []  # Replaced bundles that requests may still be using
+        self.loading_version = None
+        self.last_error = None
+        self.last_load_seconds = None
+        self.components = {}  # Readiness of each part of the active bundle
+        self.reload_parent = None  # In a prefork worker, pid of the parent that reloads for every worker
+
+    @property
+    def active(self):
+        return self._active
+
+    @property
+    def version(self):
+        bundle = self._active
+        return bundle.version if bundle is not None else None
+
+    def activate(self, bundle):
+        previous, self._active = self._active, bundle
+        if previous is not None and previous is not bundle:
+            # Requests that already hold the previous bundle may still query its store and shards
+            self._retiring.append(previous)
+            timer = threading.Timer(RETIRE_DELAY_SECONDS, self._retire, args=(previous,))
+            timer.daemon = True
+            timer.start()
+
+    def _retire(self, bundle):
+        # Streams that started on the bundle hold it open; the last one to finish closes it,
+        # off its request thread
+        bundle.when_idle(lambda: threading.Thread(target=self._close_retired, args=(bundle,), daemon=True).start())
+
+    def _close_retired(self, bundle):
+        bundle.close()
+        self._retiring.remove(bundle)
+        # A running load may have built files that nothing lists yet; it cleans up when it saves
+        if self._load_lock.acquire(blocking=False):
+            try:
+                self._remove_unused_files()
+            finally:
+                self._load_lock.release()
+
+    def _remove_unused_files(self, *loading):
+        """Delete the artifact files that neither a serving (or `loading`) bundle nor a saved artifact reads"""
+        bundles = [bundle for bundle in (self._active, *self._retiring, *loading) if bundle is not None]
+        try:
+            remove_unused_files(self.artifacts_dir, [path for bundle in bundles for path in bundle_files(bundle)])
+        except OSError as e:
+            print(f"Removing unused model files failed: {e}")
+
+    def _save(self, bundle):
+        """Save a freshly built bundle as a versioned artifact, so /admin/reload?version= can roll back to it"""
+        try:
+            path = save_bundle(bundle, self.artifacts_dir)
+            prune_artifacts(self.artifacts_dir)
+        except Exception as e:  # Serving the new bundle does not depend on the artifact
+            print(f"Saving model version {bundle.version} failed: {e}")
+            return None
+        print(f"Saved model version {bundle.version} to {path}")
+        self._remove_unused_files(bundle)  # Also those of the versions just pruned
+        return path
+
+    def _load(self, version):
+        self.loading_version = version or 'source'
+        start = time.perf_counter()
+        try:
+            if version:
+                bundle = load_bundle(version, self.artifacts_dir)
+            else:
+                bundle = build_bundle(artifacts_dir=self.artifacts_dir, n_shards=self.n_shards, precision=self.precision)
+                self._save(bundle)
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self.loading_version = None
+        self.last_load_seconds = time.perf_counter() - start
+        self.last_error = None
+        self.activate(bundle)
+        self.components = {name: {'status': 'ready', 'seconds': self.last_load_seconds} for name in COMPONENTS}
+        print(f"Activated model version {bundle.version} in {self.last_load_seconds:.1f}s")
+        return bundle
+
+    def load(self, version=None):
+        """
+        Build (version=None) or load (artifact version) a bundle and activate it.
+        Only one load runs at a time.
+        """
+        with self._load_lock:
+            return self._load(version)
+
+    def load_in_background(self, version=None):
+        """Start a load in a daemon thread; returns False if a load is already running"""
+        if not self._load_lock.acquire(blocking=False):
+            return False
+
+        def run():
+            try:
+                self._load(version)
+            except Exception as e:
+                print(f"Loading model version {version or 'source'} failed: {e}")
+            finally:
+                self._load_lock.release()
+
+        threading.Thread(target=run, name='model-loader', daemon=True).start()
+        return True
+
+    def start(self):
+        """
+        Startup without blocking: activate an empty bundle right away and fill in
+        each component from its own background thread as it finishes, so e.g.
+        autocomplete can serve before the recommender is fitted.
+        """
+        if not self._load_lock.acquire(blocking=False):
+            return False
+        bundle = ModelBundle(new_version(), None, None, None)
+        self.loading_version = bundle.version
+        self.components = {name: {'status': 'loading', 'seconds': None} for name in COMPONENTS}
+        self.activate(bundle)
+        start = time.perf_counter()
+
+        def load_trie_component():
+            bundle.trie = build_trie()
+
+        def load_recommendation_component():
+            # Set the store first: handlers check the recommender to see that both are ready
+            bundle.events, recommender = build_recommendation(
+                bundle.version, artifacts_dir=self.artifacts_dir, n_shards=self.n_shards, precision=self.precision
+            )
+            bundle.recommender = recommender
+
+        def run(name, load):
+            try:
+                load()
+            except Exception as e:
+                self.components[name] = {'status': 'failed', 'seconds': time.perf_counter() - start,
+                                         'error': f"{type(e).__name__}: {e}"}
+                print(f"Loading {name} failed: {e}")
+                return
+            self.components[name] = {'status': 'ready', 'seconds': time.perf_counter() - start}
+            print(f"{name} ready in {self.components[name]['seconds']:.1f}s")
+
+        def run_all():
+            threads = [
+                threading.Thread(target=run, args=('trie', load_trie_component), name='load-trie', daemon=True),
+                threading.Thread(target=run, args=('recommender', load_recommendation_component),
+                                 name='load-recommender', daemon=True),
+            ]
+            try:
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                failed = [name for name, info in self.components.items() if info['status'] == 'failed']
+                self.last_error = f"Failed to load: {', '.join(failed)}" if failed else None
+                self.last_load_seconds = time.perf_counter() - start
+                bundle.loaded_at = datetime.now().isoformat(timespec='seconds')
+                if not failed:
+                    self._save(bundle)
+            finally:
+                self.loading_version = None
+                self._load_lock.release()
+
+        threading.Thread(target=run_all, name='model-loader', daemon=True).start()
+        return True
+
+    def wait(self):
+        """Block until any running load has finished"""
+        with self._load_lock:
+            pass
+
+    def is_ready(self, component=None):
+        """Whether one component (or every component) of the active bundle is ready"""
+        names = [component] if component else COMPONENTS
+        return all(self.components.get(name, {}).get('status') == 'ready' for name in names)
+
+    def status(self):
+        bundle = self._active
+        return {
+            'version': bundle.version if bundle is not None else None,
+            'loaded_at': bundle.loaded_at if bundle is not None else None,
+            'loading': self.loading_version,
+            'last_load_seconds': self.last_load_seconds,
+            'last_error': self.last_error,
+        }
@@ -0,0 +1,207 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .factorModel import FactorModel
+from .quantization import from_buffers, to_buffers
+from .ratingIndex import content_scores, top_n
+from .sharedArrays import SharedArrays, attach_arrays
+
+
+class RecommendationTable:
+    """
+    Precomputed top-N recommendations for every user.
+
+    ``top_idx[row]`` holds title indices (-1 padded) and ``top_scores[row]``
+    their predicted ratings, so serving a user is a dict lookup plus a slice.
+
+    Users and titles are those of the rating data (HybridRecommender /
+    EnhancedRecommender), not the event log's user_ids and product_ids that
+    /get_recommendation serves, so the table is for offline use only.
+    """
+    def __init__(self, users, titles, top_idx, top_scores):
+        self.users = users
+        self.titles = titles
+        self.top_idx = top_idx
+        self.top_scores = top_scores
+        self.user_to_row = {user: row for row, user in enumerate(users)}
+
+    def get(self, user_id, n=None):
+        """Return [(title, score)] for a user, or [] if the user is not in the table"""
+        row = self.user_to_row.get(user_id)
+        if row is None:
+            return []
+        recommendations = []
+        for idx, score in zip(self.top_idx[row][:n], self.top_scores[row][:n]):
+            if idx < 0:
+                break
+            recommendations.append((self.titles[idx], float(score)))
+        return recommendations
+
+    def save(self, path):
+        """Write the table to a directory (the arrays are .npy so they can be memory-mapped)"""
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'top_idx.npy'), self.top_idx)
+        np.save(os.path.join(path, 'top_scores.npy'), self.top_scores)
+        with open(os.path.join(path, 'ids.json'), 'w', encoding='utf-8') as f:
+            # tolist() turns NumPy ids (e.g. from a DataFrame) into JSON-serializable Python values
+            json.dump({'users': np.asarray(self.users).tolist(), 'titles': np.asarray(self.titles).tolist()}, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Load a table written by save()"""
+        mmap_mode = 'r' if mmap else None
+        top_idx = np.load(os.path.join(path, 'top_idx.npy'), mmap_mode=mmap_mode)
+        top_scores = np.load(os.path.join(path, 'top_scores.npy'), mmap_mode=mmap_mode)
+        with open(os.path.join(path, 'ids.json'), 'r', encoding='utf-8') as f:
+            ids = json.load(f)
+        return cls(ids['users'], ids['titles'], top_idx, top_scores)
+
+
+# Set in each worker process by _init_worker
+_worker = {}
+
+
+def _init_worker(specs, settings):
+    arrays = attach_arrays(specs)
+    factors = None
+    if settings['has_factors']:
+        factors = FactorModel(
+            settings['factor_mean'], arrays['user_bias'], arrays['item_bias'],
+            from_buffers(arrays, 'user_factors'), from_buffers(arrays, 'item_factors'), settings['rating_scale']
+        )
+    _worker.update(arrays=arrays, factors=factors, settings=settings,
+                   title_similarity=from_buffers(arrays, 'title_similarity'))
+
+
+def _score_rows(start, end):
+    """Score users [start, end) and write their top-N into the shared output arrays"""
+    arrays, factors, settings = _worker['arrays'], _worker['factors'], _worker['settings']
+    indptr = arrays['indptr']
+    title_category = arrays.get('title_category')
+    n_titles = settings['n_titles']
+    n = settings['n']
+    alpha = settings['alpha']
+    global_mean = settings['global_mean']
+
+    for row in range(start, end):
+        rated_titles = arrays['title_idx'][indptr[row]:indptr[row + 1]]
+        rated_ratings = arrays['ratings'][indptr[row]:indptr[row + 1]]
+
+        if title_category is not None:
+            # Skip categories the user already owns, as EnhancedRecommender.candidate_mask does
+            owned = np.zeros(settings['n_categories'], dtype=bool)
+            owned[title_category[rated_titles]] = True
+            candidate_mask = ~owned[title_category]
+        else:
+            candidate_mask = np.ones(n_titles, dtype=bool)
+        candidate_mask[rated_titles] = False
+        candidates = np.flatnonzero(candidate_mask)
+
+        if factors is None:
+            collab_pred = np.full(len(candidates), global_mean)
+        else:
+            collab_pred = factors.predict(row, candidates)
+        content_pred = content_scores(
+            _worker['title_similarity'], rated_titles, rated_ratings, candidates, global_mean
+        )
+        scores = alpha * collab_pred + (1 - alpha) * content_pred
+
+        best = top_n(scores, n)
+        arrays['top_idx'][row, :len(best)] = candidates[best]
+        arrays['top_scores'][row, :len(best)] = scores[best]
+    return end - start
+
+
+def _model_arrays(recommender):
+    """Collect the arrays a worker needs to score users like the recommender does"""
+    index = recommender.user_index
+    # Reduced-precision matrices are shared in their compact form
+    arrays = {
+        **to_buffers('title_similarity', recommender.title_similarity),
+        'indptr': index.indptr,
+        'title_idx': index.title_idx,
+        'ratings': index.ratings,
+    }
+    if recommender.factors is not None:
+        arrays.update(
+            user_bias=recommender.factors.user_bias,
+            item_bias=recommender.factors.item_bias,
+            **to_buffers('user_factors', recommender.factors.user_factors),
+            **to_buffers('item_factors', recommender.factors.item_factors),
+        )
+    if hasattr(recommender, 'title_category'):
+        # EnhancedRecommender excludes categories the user already owns
+        arrays['title_category'] = recommender.title_category
+    return arrays
+
+
+def score_all_users(recommender, n=10, workers=None, alpha=0.5, chunk_size=None, output_path=None):
+    """
+    Score every user of a loaded and trained HybridRecommender/EnhancedRecommender
+    in parallel worker processes and build a RecommendationTable.
+
+    Model arrays are placed in shared memory once and attached by each worker,
+    and workers write their results straight into shared output arrays.
+
+    Args:
+        recommender: Loaded and trained HybridRecommender or EnhancedRecommender
+        n (int): Number of recommendations kept per user
+        workers (int, optional): Number of worker processes (default: CPU count)
+        alpha (float): Weight of the collaborative prediction, as in predict_rating
+        chunk_size (int, optional): Users per task (default: ~8 tasks per worker)
+        output_path (str, optional): Directory to save the table to
+
+    Returns:
+        tuple: (RecommendationTable, stats dict with users/sec and users/sec per core)
+    """
+    workers = workers or os.cpu_count() or 1
+    n_users = len(recommender.user_index)
+    chunk_size = chunk_size or max(1, n_users // (workers * 8))
+
+    arrays = _model_arrays(recommender)
+    arrays['top_idx'] = np.full((n_users, n), -1, dtype=np.int32)
+    arrays['top_scores'] = np.full((n_users, n), np.nan, dtype=np.float32)
+    factors = recommender.factors
+    settings = {
+        'n': n,
+        'alpha': alpha,
+        'n_titles': len(recommender.titles),
+        'n_categories': len(getattr(recommender, 'categories', ())),
+        'global_mean': float(recommender.global_mean_rating),
+        'has_factors': factors is not None,
+        'factor_mean': factors.global_mean if factors is not None else None,
+        'rating_scale': factors.rating_scale if factors is not None else None,
+    }
+
+    start_time = time.perf_counter()
+    with SharedArrays(arrays) as shared:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(shared.specs, settings)) as pool:
+            futures = [
+                pool.submit(_score_rows, start, min(start + chunk_size, n_users))
+                for start in range(0, n_users, chunk_size)
+            ]
+            scored = sum(future.result() for future in futures)
+        top_idx = shared['top_idx'].copy()
+        top_scores = shared['top_scores'].copy()
+    elapsed = time.perf_counter() - start_time
+
+    table = RecommendationTable(recommender.user_index.users, recommender.titles, top_idx, top_scores)
+    if output_path:
+        table.save(output_path)
+
+    users_per_sec = scored / elapsed if elapsed > 0 else float('inf')
+    stats = {
+        'users': scored,
+        'workers': workers,
+        'seconds': elapsed,
+        'users_per_sec': users_per_sec,
+        'users_per_sec_per_core': users_per_sec / workers,
+    }
+    print(f"Scored {scored} users in {elapsed:.2f}s with {workers} workers: "
+          f"{users_per_sec:.1f} users/sec ({stats['users_per_sec_per_core']:.1f} users/sec per core)")
+    return table, stats
@@ -0,0 +1,136 @@
+import time
+
+import numpy as np
+
+from .ratingIndex import top_n
+
+
+class InvertedFileIndex:
+    """
+    Approximate maximum-inner-product search with k-means inverted lists.
+
+    Vectors are clustered once; a query only scores the vectors of the
+    ``n_probe`` lists whose centroids have the highest inner product with it.
+    """
+    def __init__(self, vectors, n_lists=None, n_iter=10, seed=42):
+        self.vectors = np.ascontiguousarray(vectors)
+        n_vectors = len(self.vectors)
+        n_lists = n_lists or max(1, int(np.sqrt(n_vectors)))
+        n_lists = min(n_lists, n_vectors)
+
+        rng = np.random.default_rng(seed)
+        centroids = self.vectors[rng.choice(n_vectors, n_lists, replace=False)].astype(np.float64)
+        for _ in range(n_iter):
+            assignment = self._assign(centroids)
+            counts = np.bincount(assignment, minlength=n_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, self.vectors)
+            filled = counts > 0  # Empty lists keep their previous centroid
+            centroids[filled] = sums[filled] / counts[filled, None]
+        assignment = self._assign(centroids)
+
+        self.centroids = centroids.astype(self.vectors.dtype)
+        self.members = np.argsort(assignment, kind='stable')
+        self.offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=n_lists), out=self.offsets[1:])
+
+    def _assign(self, centroids):
+        # argmin ||x - c||^2 == argmin ||c||^2 - 2 x.c
+        distances = (centroids ** 2).sum(axis=1) - 2 * (self.vectors @ centroids.T)
+        return distances.argmin(axis=1)
+
+    def search(self, query, n, n_probe=8, mask=None):
+        """Indices of (approximately) the n vectors with the highest inner product with query"""
+        probed = top_n(self.centroids @ query, n_probe)
+        ids = np.concatenate([self.members[self.offsets[l]:self.offsets[l + 1]] for l in probed])
+        if mask is not None:
+            ids = ids[mask[ids]]
+        return ids[top_n(self.vectors[ids] @ query, n)]
+
+
+class TwoStageRecommender:
+    """
+    Two-stage retrieval on top of a trained HybridRecommender/EnhancedRecommender.
+
+    Stage one gathers ``n_candidates`` titles cheaply: approximate search over
+    the factor model's item vectors (bias folded in) plus the most popular
+    eligible titles. Stage two re-ranks only those candidates with the
+    recommender's full collaborative + content blend.
+    """
+    def __init__(self, recommender, n_candidates=300, n_popular=50, n_probe=16, n_lists=None, seed=42):
+        self.recommender = recommender
+        self.n_candidates = n_candidates
+        self.n_popular = n_popular
+        self.n_probe = n_probe
+
+        factors = recommender.factors
+        if factors is None:
+            raise ValueError("Train the recommender before building two-stage retrieval")
+        # [q_i, b_i] . [p_u, 1] == b_i + q_i . p_u, the user-dependent part of the SVD estimate
+        self.item_vectors = np.hstack([np.asarray(factors.item_factors), factors.item_bias[:, None]])
+        self.index = InvertedFileIndex(self.item_vectors, n_lists=n_lists, seed=seed)
+
+        popularity = np.bincount(recommender.user_index.title_idx, minlength=len(recommender.titles))
+        self.popular = np.argsort(-popularity, kind='stable')
+
+    def candidates(self, user_id, rated_titles=None):
+        """Stage one: eligible title indices to re-rank for a user"""
+        recommender = self.recommender
+        if rated_titles is None:
+            rated_titles, _ = recommender.user_index.get(user_id)
+        mask = recommender.candidate_mask(rated_titles)
+
+        popular = self.popular[mask[self.popular]][:self.n_popular]
+        row = recommender.user_index.row(user_id)
+        if row is None:
+            # No user factors: popularity is all we have
+            return self.popular[mask[self.popular]][:self.n_candidates]
+
+        factors = recommender.factors
+        query = np.append(factors.user_factors[row], 1).astype(self.item_vectors.dtype)
+        retrieved = self.index.search(query, max(self.n_candidates - len(popular), 0), self.n_probe, mask)
+        return np.union1d(retrieved, popular)
+
+    def get_recommendations(self, user_id, n=5):
+        """Stage two: re-rank the candidates with the full hybrid score"""
+        candidates = self.candidates(user_id)
+        scores = self.recommender._score(user_id, candidates)
+        best = top_n(scores, n)
+        titles = self.recommender.titles
+        return [(titles[candidates[i]], float(scores[i])) for i in best]
+
+    def recall_report(self, user_ids=None, n=5, sample_size=200, seed=42):
+        """
+        Compare against exhaustive scoring: recall@n of the exhaustive top n
+        and mean latency of both paths.
+        """
+        users = self.recommender.user_index.users
+        if user_ids is None:
+            rng = np.random.default_rng(seed)
+            user_ids = users[rng.choice(len(users), min(sample_size, len(users)), replace=False)]
+
+        recalls, exhaustive_ms, two_stage_ms = [], [], []
+        for user_id in user_ids:
+            start = time.perf_counter()
+            exhaustive = self.recommender.get_recommendations(user_id, n)
+            exhaustive_ms.append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            two_stage = self.get_recommendations(user_id, n)
+            two_stage_ms.append((time.perf_counter() - start) * 1000)
+
+            expected = {title for title, _ in exhaustive}
+            if expected:
+                recalls.append(len(expected & {title for title, _ in two_stage}) / len(expected))
+
+        report = {
+            'users': len(exhaustive_ms),
+            'n_candidates': self.n_candidates,
+            f'recall@{n}': float(np.mean(recalls)) if recalls else None,
+            'exhaustive_ms': float(np.mean(exhaustive_ms)) if exhaustive_ms else None,
+            'two_stage_ms': float(np.mean(two_stage_ms)) if two_stage_ms else None,
+        }
+        if recalls:
+            print(f"Two-stage retrieval with {self.n_candidates} candidates: recall@{n} vs exhaustive "
+                  f"{report[f'recall@{n}']:.3f}, {report['two_stage_ms']:.2f}ms vs "
+                  f"{report['exhaustive_ms']:.2f}ms per user")
+        return report
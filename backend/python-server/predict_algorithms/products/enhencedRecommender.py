@@ -1,103 +1,181 @@
 from surprise import SVD, Reader, Dataset
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
-import json
+from scipy.sparse import vstack
 import pandas as pd
 import numpy as np
+from .ratingsLoader import read_ratings, load_ratings_jsonl
+from .ratingIndex import UserRatingIndex, content_scores, top_n
+from .factorModel import FactorModel
+from .matrixFactorization import MatrixFactorization
+from .quantization import PRECISIONS, quantize
+from .titleVectorizer import REWEIGHT_AFTER, HashingTitleVectorizer, extend_similarity
 
 class EnhancedRecommender:
-    def __init__(self):
+    def __init__(self, engine='surprise', precision='float64', content_features='tfidf'):
+        if engine not in ('surprise', 'native'):
+            raise ValueError(f"Unknown training engine: {engine}")
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision: {precision}")
+        if content_features not in ('tfidf', 'hashing'):
+            raise ValueError(f"Unknown content features: {content_features}")
+        self.engine = engine
+        # Storage precision of title_similarity and the factor matrices
+        self.precision = precision
+        self.content_features = content_features
         self.svd = SVD(n_factors=100, n_epochs=20, lr_all=0.005, reg_all=0.02)
-        self.vectorizer = TfidfVectorizer(min_df=1, stop_words='english')
+        self.mf = MatrixFactorization(n_factors=100, n_epochs=20)  # NumPy ALS, used when engine='native'
+        if content_features == 'hashing':
+            self.vectorizer = HashingTitleVectorizer()  # Vocabulary-free, supports add_titles()
+        else:
+            self.vectorizer = TfidfVectorizer(min_df=1, stop_words='english')
+        self.factors = None  # Collaborative model as plain arrays, filled in by train()
         
     def load_data(self, json_data):
         """Load and prepare data from simplified JSONL format"""
-        records = []
-        for line in json_data.split('\n'):
-            if line.strip():
-                user_data = json.loads(line)
-                user_id = user_data['user_id']
-                for product in user_data['products']:
-                    records.append({
-                        'user_id': user_id,
-                        'title': product['title'],
-                        'rating': product['ratings'][0]  # Using first rating
-                    })
-        
-        self.df = pd.DataFrame(records)
+        self.load_ratings(read_ratings(json_data.splitlines(), first_rating_only=True))
+        
+    def load_jsonl(self, jsonl_path, sample_size=None, seed=None):
+        """Stream data from a JSONL file, optionally sampling sample_size users"""
+        self.load_ratings(load_ratings_jsonl(
+            jsonl_path, sample_size=sample_size, first_rating_only=True, seed=seed
+        ))
+        
+    def load_ratings(self, data):
+        """Prepare the recommender from integer-coded RatingsData"""
+        self.df = data.to_frame()
+        self.titles = data.titles
         self._prepare_content_features()
-        self.global_mean_rating = self.df['rating'].mean()
+        self._prepare_category_index()
+        self.user_index = UserRatingIndex(data.users, data.user_codes, data.title_codes, data.ratings)
+        self.global_mean_rating = float(data.ratings.mean(dtype=np.float64))
         
     def _prepare_content_features(self):
         """Prepare content-based features from simplified titles"""
-        unique_titles = self.df['title'].unique()
-        self.title_vectors = self.vectorizer.fit_transform(unique_titles)
-        self.title_similarity = cosine_similarity(self.title_vectors)
-        self.title_to_index = {title: idx for idx, title in enumerate(unique_titles)}
+        self.title_vectors = self.vectorizer.fit_transform(self.titles)
+        self.title_similarity = quantize(cosine_similarity(self.title_vectors), self.precision)
+        self.title_to_index = {title: idx for idx, title in enumerate(self.titles)}
+        self._titles_vectorized = len(self.titles)  # Catalog size at the last full vectorization
+        self._similarity_spare = None  # Spare capacity behind title_similarity (see add_titles)
         
     def get_product_category(self, title):
         """Extract main product category from simplified title"""
         words = title.lower().split()
         return words[-1] if words else None  # Last word is the product type
         
+    def _prepare_category_index(self):
+        """Compute the category of every title once, as an integer code per title"""
+        categories = pd.Series([self.get_product_category(title) for title in self.titles], dtype=object)
+        self.title_category, self.categories = pd.factorize(categories, use_na_sentinel=False)
+        
+    def add_titles(self, titles):
+        """
+        Add products without refitting (content_features='hashing'): only the new
+        titles are vectorized and compared against the catalog. They have no
+        ratings, so the collaborative part treats them as unknown until train().
+        
+        Existing titles keep the idf weights they were vectorized with, so once
+        the catalog has grown by REWEIGHT_AFTER since the last full vectorization,
+        all titles are re-vectorized and title_similarity is recomputed.
+        
+        Returns:
+            int: Number of titles that were new
+        """
+        if self.content_features != 'hashing':
+            raise ValueError("add_titles requires content_features='hashing'")
+        new_titles = [title for title in dict.fromkeys(titles) if title not in self.title_to_index]
+        if not new_titles:
+            return 0
+        
+        appended = np.empty(len(new_titles), dtype=object)
+        appended[:] = new_titles
+        titles = np.concatenate([self.titles, appended])
+        if len(titles) > self._titles_vectorized * (1 + REWEIGHT_AFTER):
+            self.titles = titles
+            self._prepare_content_features()
+        else:
+            new_vectors = self.vectorizer.partial_fit_transform(new_titles)
+            self.title_vectors = vstack([self.title_vectors, new_vectors], format='csr')
+            self.title_similarity, self._similarity_spare = extend_similarity(
+                self.title_similarity, cosine_similarity(new_vectors, self.title_vectors),
+                self._similarity_spare
+            )
+            for idx, title in enumerate(new_titles, start=len(self.titles)):
+                self.title_to_index[title] = idx
+            self.titles = titles
+        self._prepare_category_index()
+        return len(new_titles)
+        
+    def __getstate__(self):
+        # The spare buffer would be pickled next to title_similarity; it is reallocated on demand
+        return {**self.__dict__, '_similarity_spare': None}
+        
+    def candidate_mask(self, rated_titles):
+        """Boolean mask over titles that are unrated and not in a category the user owns"""
+        owned = np.zeros(len(self.categories), dtype=bool)
+        owned[self.title_category[rated_titles]] = True
+        mask = ~owned[self.title_category]
+        mask[rated_titles] = False
+        return mask
+        
     def get_recommendations(self, user_id, n=5):
         """Get recommendations avoiding categories user already owns"""
-        all_products = self.df['title'].unique()
-        
-        # Get user's owned categories
-        user_products = self.df[self.df['user_id'] == user_id]['title']
-        owned_categories = {self.get_product_category(title) for title in user_products}
-        
-        # Filter unrated products
-        user_rated = set(user_products)
-        unrated_products = [p for p in all_products if p not in user_rated 
-                          and self.get_product_category(p) not in owned_categories]
-        
-        predictions = [
-            (product, self.predict_rating(user_id, product))
-            for product in unrated_products
-        ]
-        
-        return sorted(predictions, key=lambda x: x[1], reverse=True)[:n]
+        rated_titles, _ = self.user_index.get(user_id)
+        candidates = np.flatnonzero(self.candidate_mask(rated_titles))
+        
+        scores = self._score(user_id, candidates)
+        best = top_n(scores, n)
+        return [(self.titles[candidates[i]], float(scores[i])) for i in best]
+        
+    def _score(self, user_id, candidates, alpha=0.5):
+        """Hybrid prediction for an array of title indices"""
+        if self.factors is None:
+            collab_pred = np.full(len(candidates), self.global_mean_rating)
+        else:
+            collab_pred = self.factors.predict(self.user_index.row(user_id), candidates)
+            
+        content_pred = self._get_content_based_scores(user_id, candidates)
+        return alpha * collab_pred + (1 - alpha) * content_pred
         
     def predict_rating(self, user_id, product_title, alpha=0.5):
         """Hybrid prediction combining collaborative and content-based"""
-        try:
-            collab_pred = self.svd.predict(user_id, product_title).est
-        except:
-            collab_pred = self.global_mean_rating
-            
-        content_pred = self._get_content_based_prediction(user_id, product_title)
-        return alpha * collab_pred + (1 - alpha) * content_pred
+        candidates = np.array([self.title_to_index.get(product_title, -1)])  # -1 = unknown product
+        return float(self._score(user_id, candidates, alpha)[0])
+        
+    def _get_content_based_scores(self, user_id, candidates):
+        """Content-based predictions for an array of title indices"""
+        rated_titles, rated_ratings = self.user_index.get(user_id)
+        return content_scores(
+            self.title_similarity, rated_titles, rated_ratings, candidates, self.global_mean_rating
+        )
         
     def _get_content_based_prediction(self, user_id, product_title):
         """Content-based prediction using product similarities"""
-        user_ratings = self.df[self.df['user_id'] == user_id]
-        
-        if len(user_ratings) == 0 or product_title not in self.title_to_index:
-            return self.global_mean_rating
+        candidates = np.array([self.title_to_index.get(product_title, -1)])
+        return float(self._get_content_based_scores(user_id, candidates)[0])
+        
+    def _set_factors(self, model):
+        """Keep a trained FactorModel, stored at the configured precision, without a full-precision copy"""
+        self.factors = model if self.precision == 'float64' else model.quantized(self.precision)
+        if self.mf.model is model:
+            self.mf.model = self.factors  # Warm starts continue from the stored (dequantized) factors
+        # Predictions only use self.factors; Surprise's float64 arrays and trainset would stay alongside
+        self.svd.pu = self.svd.qi = self.svd.bu = self.svd.bi = None
+        self.svd.trainset = None
+        
+    def train(self, warm_start=False):
+        """Train the collaborative filtering model (warm_start only applies to engine='native')"""
+        if self.engine == 'native':
+            user_rows, title_idx, ratings = self.user_index.triples()
+            self._set_factors(self.mf.fit(
+                user_rows, title_idx, ratings,
+                n_users=len(self.user_index), n_titles=len(self.titles), warm_start=warm_start,
+                user_ids=self.user_index.users, title_ids=self.titles
+            ))
+            return
             
-        similar_ratings = []
-        prod_idx = self.title_to_index[product_title]
-        
-        for _, row in user_ratings.iterrows():
-            if row['title'] in self.title_to_index:
-                idx = self.title_to_index[row['title']]
-                similarity = self.title_similarity[prod_idx][idx]
-                if similarity > 0:
-                    similar_ratings.append((similarity, row['rating']))
-        
-        if not similar_ratings:
-            return self.global_mean_rating
-            
-        weights = np.array([s[0] for s in similar_ratings])
-        ratings = np.array([s[1] for s in similar_ratings])
-        
-        return np.average(ratings, weights=weights) if weights.sum() > 0 else self.global_mean_rating
-        
-    def train(self):
-        """Train the collaborative filtering model"""
         reader = Reader(rating_scale=(1, 5))
         data = Dataset.load_from_df(self.df[['user_id', 'title', 'rating']], reader)
         trainset = data.build_full_trainset()
-        self.svd.fit(trainset)
\ No newline at end of file
+        self.svd.fit(trainset)
+        self._set_factors(FactorModel.from_surprise(self.svd, trainset, self.user_index.users, self.titles))
@@ -0,0 +1,92 @@
+import numpy as np
+
+from .quantization import quantize
+
+
+class FactorModel:
+    """
+    Biased matrix factorization stored as plain arrays in our own coding:
+    users by their row in the UserRatingIndex, items by their title index.
+
+    Prediction follows Surprise's SVD: ``mu + b_u + b_i + q_i . p_u``, where
+    unknown users/items contribute nothing, clipped to the rating scale.
+    """
+    def __init__(self, global_mean, user_bias, item_bias, user_factors, item_factors,
+                 rating_scale=(1, 5)):
+        self.global_mean = float(global_mean)
+        self.user_bias = user_bias
+        self.item_bias = item_bias
+        self.user_factors = user_factors
+        self.item_factors = item_factors
+        self.rating_scale = rating_scale
+
+    @classmethod
+    def from_surprise(cls, algo, trainset, users, titles):
+        """Copy a fitted Surprise SVD into arrays indexed by our user rows / title indices"""
+        n_factors = algo.pu.shape[1]
+        user_bias = np.zeros(len(users))
+        item_bias = np.zeros(len(titles))
+        user_factors = np.zeros((len(users), n_factors))
+        item_factors = np.zeros((len(titles), n_factors))
+
+        for row, user in enumerate(users):
+            try:
+                inner = trainset.to_inner_uid(user)
+            except ValueError:
+                continue  # Unknown to the trainset, keep zero bias/factors
+            user_bias[row] = algo.bu[inner]
+            user_factors[row] = algo.pu[inner]
+
+        for idx, title in enumerate(titles):
+            try:
+                inner = trainset.to_inner_iid(title)
+            except ValueError:
+                continue
+            item_bias[idx] = algo.bi[inner]
+            item_factors[idx] = algo.qi[inner]
+
+        return cls(trainset.global_mean, user_bias, item_bias, user_factors, item_factors,
+                   trainset.rating_scale)
+
+    def quantized(self, precision):
+        """
+        Copy of the model with the factor matrices stored at a reduced precision
+        ('float32', 'float16' or 'int8' with per-row scales).
+        """
+        bias_dtype = np.float64 if precision == 'float64' else np.float32
+        return FactorModel(
+            self.global_mean, self.user_bias.astype(bias_dtype), self.item_bias.astype(bias_dtype),
+            quantize(self.user_factors, precision), quantize(self.item_factors, precision),
+            self.rating_scale
+        )
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.user_bias, self.item_bias, self.user_factors, self.item_factors))
+
+    def predict(self, user_row, items):
+        """
+        Predicted ratings of one user for an array of title indices.
+
+        ``user_row`` is None for unknown users; title index -1 marks an unknown item,
+        as do indices of titles added after training.
+        """
+        items = np.asarray(items)
+        known = (items >= 0) & (items < len(self.item_bias))
+        safe_items = np.where(known, items, 0)
+        est = self.global_mean + np.where(known, self.item_bias[safe_items], 0)
+        if user_row is not None:
+            dot = self.item_factors[safe_items] @ self.user_factors[user_row]
+            est = est + self.user_bias[user_row] + np.where(known, dot, 0)
+        return np.clip(est, *self.rating_scale)
+
+    def predict_pairs(self, user_rows, items):
+        """Predicted ratings for parallel arrays of user rows and title indices (all known)"""
+        est = self.global_mean + self.user_bias[user_rows] + self.item_bias[items]
+        est = est + np.einsum('ij,ij->i', self.user_factors[user_rows], self.item_factors[items])
+        return np.clip(est, *self.rating_scale)
+
+    def rmse(self, user_rows, items, ratings):
+        """Root mean squared error of predict_pairs against known ratings"""
+        errors = self.predict_pairs(user_rows, items) - ratings
+        return float(np.sqrt(np.mean(errors ** 2)))
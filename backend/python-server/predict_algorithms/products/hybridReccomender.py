@@ -3,10 +3,26 @@ import numpy as np
 from surprise import SVD, Reader, Dataset
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
-import json
+from scipy.sparse import vstack
+from .ratingsLoader import read_ratings, load_ratings_jsonl
+from .ratingIndex import UserRatingIndex, content_scores, top_n
+from .factorModel import FactorModel
+from .matrixFactorization import MatrixFactorization
+from .quantization import PRECISIONS, quantize
+from .titleVectorizer import REWEIGHT_AFTER, HashingTitleVectorizer, extend_similarity
 
 class HybridRecommender:
-    def __init__(self):
+    def __init__(self, engine='surprise', precision='float64', content_features='tfidf'):
+        if engine not in ('surprise', 'native'):
+            raise ValueError(f"Unknown training engine: {engine}")
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision: {precision}")
+        if content_features not in ('tfidf', 'hashing'):
+            raise ValueError(f"Unknown content features: {content_features}")
+        self.engine = engine
+        # Storage precision of title_similarity and the factor matrices
+        self.precision = precision
+        self.content_features = content_features
         # Initialize the SVD model for collaborative filtering
         self.svd = SVD(
             n_factors=100,  # Number of latent factors
@@ -14,41 +30,66 @@ class HybridRecommender:
             lr_all=0.005,   # Learning rate
             reg_all=0.02    # Regularization
         )
-        # Initialize TF-IDF for processing product titles
-        self.vectorizer = TfidfVectorizer(min_df=1, stop_words='english')
+        # NumPy ALS alternative to Surprise, used when engine='native'
+        self.mf = MatrixFactorization(n_factors=100, n_epochs=20)
+        # Initialize TF-IDF for processing product titles; the hashing variant has no
+        # vocabulary, so titles can be added later with add_titles()
+        if content_features == 'hashing':
+            self.vectorizer = HashingTitleVectorizer()
+        else:
+            self.vectorizer = TfidfVectorizer(min_df=1, stop_words='english')
+        # Collaborative model as plain arrays, filled in by train()
+        self.factors = None
         
     def load_data(self, json_data):
         """Load and prepare data from JSON format"""
-        # Convert JSON to list of records
-        records = []
-        for line in json_data.split('\n'):
-            if line.strip():  # Skip empty lines
-                user_data = json.loads(line)
-                user_id = user_data['user_id']
-                # Extract each product rating
-                for product in user_data['products']:
-                    for rating in product['ratings']:
-                        records.append({
-                            'user_id': user_id,
-                            'title': product['title'],
-                            'rating': rating
-                        })
-        
-        # Convert to DataFrame
-        self.df = pd.DataFrame(records)
-        print(f"Loaded {len(self.df)} ratings for {len(self.df['user_id'].unique())} users")
+        self.load_ratings(read_ratings(json_data.splitlines()))
+        
+    def load_jsonl(self, jsonl_path, sample_size=None, seed=None):
+        """Stream data from a JSONL file, optionally sampling sample_size users"""
+        self.load_ratings(load_ratings_jsonl(jsonl_path, sample_size=sample_size, seed=seed))
+        
+    def load_ratings(self, data):
+        """Prepare the recommender from integer-coded RatingsData"""
+        self.df = data.to_frame()
+        print(f"Loaded {len(data)} ratings for {len(data.users)} users")
         
         # Create product feature vectors from titles
-        unique_titles = self.df['title'].unique()
-        self.title_vectors = self.vectorizer.fit_transform(unique_titles)
-        self.title_similarity = cosine_similarity(self.title_vectors)
-        self.title_to_index = {title: idx for idx, title in enumerate(unique_titles)}
+        self.titles = data.titles
+        self._prepare_content_features()
+        
+        # Per-user ratings as CSR arrays so lookups avoid scanning self.df
+        self.user_index = UserRatingIndex(data.users, data.user_codes, data.title_codes, data.ratings)
         
         # Calculate global mean rating
-        self.global_mean_rating = self.df['rating'].mean()
+        self.global_mean_rating = float(data.ratings.mean(dtype=np.float64))
+        
+    def _prepare_content_features(self):
+        """Vectorize all titles and compute their similarity matrix"""
+        self.title_vectors = self.vectorizer.fit_transform(self.titles)
+        self.title_similarity = quantize(cosine_similarity(self.title_vectors), self.precision)
+        self.title_to_index = {title: idx for idx, title in enumerate(self.titles)}
+        self._titles_vectorized = len(self.titles)  # Catalog size at the last full vectorization
+        self._similarity_spare = None  # Spare capacity behind title_similarity (see add_titles)
+        
+    def train(self, warm_start=False):
+        """
+        Train the recommender system
+        
+        Args:
+            warm_start (bool): With engine='native', continue from the previous factors
+        """
+        if self.engine == 'native':
+            print("Training native matrix factorization...")
+            user_rows, title_idx, ratings = self.user_index.triples()
+            self._set_factors(self.mf.fit(
+                user_rows, title_idx, ratings,
+                n_users=len(self.user_index), n_titles=len(self.titles), warm_start=warm_start,
+                user_ids=self.user_index.users, title_ids=self.titles
+            ))
+            print("Training completed!")
+            return
         
-    def train(self):
-        """Train the recommender system"""
         # Prepare data for SVD
         reader = Reader(rating_scale=(1, 5))
         data = Dataset.load_from_df(
@@ -60,8 +101,20 @@ class HybridRecommender:
         # Train the SVD model
         print("Training SVD model...")
         self.svd.fit(trainset)
+        self._set_factors(FactorModel.from_surprise(
+            self.svd, trainset, self.user_index.users, self.titles
+        ))
         print("Training completed!")
         
+    def _set_factors(self, model):
+        """Keep a trained FactorModel, stored at the configured precision, without a full-precision copy"""
+        self.factors = model if self.precision == 'float64' else model.quantized(self.precision)
+        if self.mf.model is model:
+            self.mf.model = self.factors  # Warm starts continue from the stored (dequantized) factors
+        # Predictions only use self.factors; Surprise's float64 arrays and trainset would stay alongside
+        self.svd.pu = self.svd.qi = self.svd.bu = self.svd.bi = None
+        self.svd.trainset = None
+        
     def find_similar_products(self, product_title, n=5):
         """Find similar products based on title similarity"""
         if product_title not in self.title_to_index:
@@ -75,68 +128,87 @@ class HybridRecommender:
         similar_products = []
         
         for idx in similar_indices:
-            title = list(self.title_to_index.keys())[list(self.title_to_index.values()).index(idx)]
-            score = similarity_scores[idx]
-            similar_products.append((title, score))
+            similar_products.append((self.titles[idx], similarity_scores[idx]))
             
         return similar_products
         
+    def add_titles(self, titles):
+        """
+        Add products without refitting (content_features='hashing'): only the new
+        titles are vectorized and compared against the catalog. They have no
+        ratings, so the collaborative part treats them as unknown until train().
+        
+        Existing titles keep the idf weights they were vectorized with, so once
+        the catalog has grown by REWEIGHT_AFTER since the last full vectorization,
+        all titles are re-vectorized and title_similarity is recomputed.
+        
+        Returns:
+            int: Number of titles that were new
+        """
+        if self.content_features != 'hashing':
+            raise ValueError("add_titles requires content_features='hashing'")
+        new_titles = [title for title in dict.fromkeys(titles) if title not in self.title_to_index]
+        if not new_titles:
+            return 0
+        
+        appended = np.empty(len(new_titles), dtype=object)
+        appended[:] = new_titles
+        titles = np.concatenate([self.titles, appended])
+        if len(titles) > self._titles_vectorized * (1 + REWEIGHT_AFTER):
+            self.titles = titles
+            self._prepare_content_features()
+            return len(new_titles)
+        
+        new_vectors = self.vectorizer.partial_fit_transform(new_titles)
+        self.title_vectors = vstack([self.title_vectors, new_vectors], format='csr')
+        self.title_similarity, self._similarity_spare = extend_similarity(
+            self.title_similarity, cosine_similarity(new_vectors, self.title_vectors),
+            self._similarity_spare
+        )
+        for idx, title in enumerate(new_titles, start=len(self.titles)):
+            self.title_to_index[title] = idx
+        self.titles = titles
+        return len(new_titles)
+        
+    def __getstate__(self):
+        # The spare buffer would be pickled next to title_similarity; it is reallocated on demand
+        return {**self.__dict__, '_similarity_spare': None}
+        
+    def _collaborative_scores(self, user_id, candidates):
+        """Collaborative filtering predictions for an array of title indices"""
+        if self.factors is None:
+            return np.full(len(candidates), self.global_mean_rating)
+        return self.factors.predict(self.user_index.row(user_id), candidates)
+        
+    def _score(self, user_id, candidates, alpha=0.5):
+        """Blend collaborative and content-based predictions for an array of title indices"""
+        rated_titles, rated_ratings = self.user_index.get(user_id)
+        collab_pred = self._collaborative_scores(user_id, candidates)
+        content_pred = content_scores(
+            self.title_similarity, rated_titles, rated_ratings, candidates, self.global_mean_rating
+        )
+        return alpha * collab_pred + (1 - alpha) * content_pred
+        
     def predict_rating(self, user_id, product_title, alpha=0.5):
         """Predict rating combining collaborative and content-based approaches"""
-        try:
-            # Try collaborative filtering prediction
-            collab_pred = self.svd.predict(user_id, product_title).est
-        except:
-            # If user or item is unknown, use default
-            collab_pred = self.global_mean_rating
-            
-        # Content-based prediction using product similarities
-        user_ratings = self.df[self.df['user_id'] == user_id]
+        # Unknown products are coded as -1 and get the global mean for the content part
+        candidates = np.array([self.title_to_index.get(product_title, -1)])
+        return float(self._score(user_id, candidates, alpha)[0])
         
-        if len(user_ratings) == 0:
-            # New user - use average product rating
-            content_pred = self.global_mean_rating
-        else:
-            # Find similar products the user has rated
-            similar_ratings = []
-            for _, row in user_ratings.iterrows():
-                if product_title in self.title_to_index and row['title'] in self.title_to_index:
-                    idx1 = self.title_to_index[product_title]
-                    idx2 = self.title_to_index[row['title']]
-                    similarity = self.title_similarity[idx1][idx2]
-                    if similarity > 0:  # Only consider positive similarities
-                        similar_ratings.append((similarity, row['rating']))
-            
-            if similar_ratings:
-                # Weighted average of ratings based on similarity
-                weights = np.array([s[0] for s in similar_ratings])
-                ratings = np.array([s[1] for s in similar_ratings])
-                
-                # Check if weights sum to zero
-                if weights.sum() > 0:
-                    content_pred = np.average(ratings, weights=weights)
-                else:
-                    content_pred = self.global_mean_rating
-            else:
-                content_pred = self.global_mean_rating
-        
-        # Combine predictions
-        return alpha * collab_pred + (1 - alpha) * content_pred
+    def candidate_mask(self, rated_titles):
+        """Boolean mask over titles the user hasn't rated yet"""
+        unrated = np.ones(len(self.titles), dtype=bool)
+        unrated[rated_titles] = False
+        return unrated
         
     def get_recommendations(self, user_id, n=5):
         """Get top N recommendations for a user"""
-        all_products = self.df['title'].unique()
-        predictions = []
-        
         # Get products the user hasn't rated yet
-        user_rated_products = set(self.df[self.df['user_id'] == user_id]['title'])
-        unrated_products = [p for p in all_products if p not in user_rated_products]
-        
-        # Get predictions for unrated products
-        for product in unrated_products:
-            pred_rating = self.predict_rating(user_id, product)
-            predictions.append((product, pred_rating))
-        
-        # Sort by predicted rating and return top N
-        return sorted(predictions, key=lambda x: x[1], reverse=True)[:n]
-__all__ = ['HybridRecommender']
\ No newline at end of file
+        rated_titles, _ = self.user_index.get(user_id)
+        candidates = np.flatnonzero(self.candidate_mask(rated_titles))
+        
+        # Score all unrated products at once and return top N
+        scores = self._score(user_id, candidates)
+        best = top_n(scores, n)
+        return [(self.titles[candidates[i]], float(scores[i])) for i in best]
+__all__ = ['HybridRecommender']
@@ -0,0 +1,220 @@
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import Manager
+
+import numpy as np
+import pandas as pd
+from surprise import SVD, Reader, Dataset
+
+from .factorModel import FactorModel
+from .matrixFactorization import MatrixFactorization
+from .productRecommender import ProductRecommender
+from .sharedArrays import SharedArrays, attach_arrays
+
+
+def _candidates(param_grid=None, param_distributions=None, n_iter=10, seed=42):
+    """Parameter dicts to try: the full grid, or n_iter random draws from the distributions"""
+    if param_grid is not None:
+        keys = list(param_grid)
+        return [dict(zip(keys, values)) for values in itertools.product(*(param_grid[key] for key in keys))]
+
+    rng = np.random.default_rng(seed)
+    candidates = []
+    for _ in range(n_iter):
+        params = {}
+        for key, values in param_distributions.items():
+            if hasattr(values, 'rvs'):
+                params[key] = values.rvs(random_state=rng)  # scipy.stats distribution
+            else:
+                params[key] = values[rng.integers(len(values))]
+        candidates.append({key: value.item() if hasattr(value, 'item') else value
+                           for key, value in params.items()})
+    return candidates
+
+
+# Set in each worker process by _init_worker
+_worker = {}
+
+
+def _init_worker(specs, settings, board, lock):
+    _worker.update(arrays=attach_arrays(specs), settings=settings, board=board, lock=lock)
+
+
+def _should_prune(epoch, rmse):
+    """Median rule: stop a trial that is worse than the median of earlier trials at this epoch"""
+    settings, board, lock = _worker['settings'], _worker['board'], _worker['lock']
+    with lock:
+        previous = board.get(epoch, [])
+        board[epoch] = previous + [rmse]
+    if not settings['prune'] or len(previous) < settings['min_trials_for_pruning']:
+        return False
+    return rmse > np.median(previous)
+
+
+def _factor_trial(params):
+    """Train an ALS configuration in checkpoints (an SVD one in one go), reporting validation RMSE"""
+    arrays, settings = _worker['arrays'], _worker['settings']
+    params = dict(params)
+    n_epochs = params.pop('n_epochs', 20)
+    checkpoints = sorted({max(1, round(n_epochs * (i + 1) / settings['checkpoints']))
+                          for i in range(settings['checkpoints'])})
+    validation = (arrays['val_users'], arrays['val_titles'], arrays['val_ratings'])
+
+    history = []
+    if settings['model'] == 'native':
+        # One thread per trial; the parallelism comes from the worker processes. The search
+        # scores on its own validation split, so ALS keeps all training ratings
+        mf = MatrixFactorization(n_epochs=0, random_state=settings['seed'],
+                                 **{'n_threads': 1, 'validation_fraction': 0.0, **params})
+        trained = 0
+        for epoch in checkpoints:
+            # Warm start continues from the previous checkpoint's factors
+            mf.n_epochs = epoch - trained
+            model = mf.fit(arrays['train_users'], arrays['train_titles'], arrays['train_ratings'],
+                           settings['n_users'], settings['n_titles'], warm_start=trained > 0)
+            trained = epoch
+            history.append({'epoch': epoch, 'val_rmse': model.rmse(*validation)})
+            if _should_prune(epoch, history[-1]['val_rmse']):
+                return history, True
+        return history, False
+
+    # Surprise cannot resume training, so intermediate checkpoints would each retrain from
+    # scratch and cost more than they save: fit fully once and report the final RMSE
+    df = pd.DataFrame({
+        'user_id': arrays['train_users'], 'title': arrays['train_titles'], 'rating': arrays['train_ratings']
+    })
+    trainset = Dataset.load_from_df(df, Reader(rating_scale=(1, 5))).build_full_trainset()
+    svd = SVD(n_epochs=n_epochs, random_state=settings['seed'], **params)
+    svd.fit(trainset)
+    model = FactorModel.from_surprise(
+        svd, trainset, np.arange(settings['n_users']), np.arange(settings['n_titles'])
+    )
+    history.append({'epoch': n_epochs, 'val_rmse': model.rmse(*validation)})
+    return history, False
+
+
+def _product_trial(params):
+    """Fit ProductRecommender on the training events and measure recall@k on the test events"""
+    arrays, settings = _worker['arrays'], _worker['settings']
+    k = settings['k']
+    train_df = pd.DataFrame({'user_id': arrays['train_users'], 'product_id': arrays['train_products']})
+    recommender = ProductRecommender(**params).fit(train_df)
+
+    last_viewed = train_df.groupby('user_id')['product_id'].last()
+    seen = train_df.groupby('user_id')['product_id'].agg(set)
+    test_df = pd.DataFrame({'user_id': arrays['test_users'], 'product_id': arrays['test_products']})
+    recalls = []
+    for user_id, products in test_df.groupby('user_id')['product_id']:
+        if len(recalls) >= settings['max_queries']:
+            break
+        if user_id not in last_viewed.index:
+            continue
+        relevant = set(products) - seen[user_id]
+        if relevant:
+            recommended = recommender.get_similar_product_ids(last_viewed[user_id], k)
+            recalls.append(len(set(recommended) & relevant) / len(relevant))
+    return [{f'recall@{k}': float(np.mean(recalls)) if recalls else 0.0}], False
+
+
+def _run_trial(trial_id, params):
+    start = time.perf_counter()
+    if _worker['settings']['model'] == 'product':
+        history, pruned = _product_trial(params)
+    else:
+        history, pruned = _factor_trial(params)
+    return {
+        'trial': trial_id,
+        'params': params,
+        'history': history,
+        'pruned': pruned,
+        'seconds': time.perf_counter() - start,
+        **{key: value for key, value in history[-1].items() if key != 'epoch'},
+    }
+
+
+def hyperparameter_search(model, data=None, df=None, param_grid=None, param_distributions=None,
+                          n_iter=10, workers=None, test_size=0.2, k=5, max_queries=500, checkpoints=4,
+                          prune=True, min_trials_for_pruning=3, seed=42, report_path=None):
+    """
+    Evaluate recommender configurations in parallel worker processes.
+
+    The encoded train/validation split is placed in shared memory once and
+    every worker attaches to it. Native ALS trials report validation RMSE at a
+    few epoch checkpoints (each continuing from the last) and are stopped early
+    when they are worse than the median of earlier trials at the same
+    checkpoint. Surprise SVD cannot resume training, so its trials are fitted
+    fully and reported once.
+
+    Args:
+        model (str): 'product' (ProductRecommender, e.g. n_neighbors), 'svd' (Surprise)
+            or 'native' (MatrixFactorization), e.g. n_factors / n_epochs / reg_all or reg
+        data (RatingsData): Ratings for 'svd' / 'native'
+        df (DataFrame): Events with user_id / product_id for 'product'
+        param_grid (dict): Lists of values to try exhaustively
+        param_distributions (dict): Lists or scipy.stats distributions to draw n_iter samples from
+        n_iter (int): Number of random configurations
+        workers (int, optional): Number of worker processes (default: CPU count)
+        test_size (float): Fraction of ratings/events used for validation
+        k (int): Cut-off for recall@k ('product')
+        max_queries (int): Number of test users queried per 'product' trial
+        checkpoints (int): Number of epoch checkpoints per 'native' trial
+        prune (bool): Stop trials early with the median rule
+        min_trials_for_pruning (int): Checkpoint results needed before pruning starts
+        seed (int): Seed for the split, the random search and the models
+        report_path (str, optional): Where to write the trials as JSON
+
+    Returns:
+        list: Trial results sorted best first, each with params, metric, history and seconds
+    """
+    if model not in ('product', 'svd', 'native'):
+        raise ValueError(f"Unknown model: {model}")
+    if (param_grid is None) == (param_distributions is None):
+        raise ValueError("Pass exactly one of param_grid or param_distributions")
+
+    rng = np.random.default_rng(seed)
+    settings = {'model': model, 'k': k, 'max_queries': max_queries, 'checkpoints': checkpoints, 'prune': prune,
+                'min_trials_for_pruning': min_trials_for_pruning, 'seed': seed}
+    if model == 'product':
+        user_codes, _ = pd.factorize(df['user_id'])
+        product_codes, _ = pd.factorize(df['product_id'])
+        test = rng.random(len(df)) < test_size
+        arrays = {
+            'train_users': user_codes[~test], 'train_products': product_codes[~test],
+            'test_users': user_codes[test], 'test_products': product_codes[test],
+        }
+        metric, lower_is_better = f'recall@{k}', False
+    else:
+        test = rng.random(len(data)) < test_size
+        arrays = {
+            'train_users': data.user_codes[~test], 'train_titles': data.title_codes[~test],
+            'train_ratings': data.ratings[~test],
+            'val_users': data.user_codes[test], 'val_titles': data.title_codes[test],
+            'val_ratings': data.ratings[test],
+        }
+        settings.update(n_users=len(data.users), n_titles=len(data.titles))
+        metric, lower_is_better = 'val_rmse', True
+
+    candidates = _candidates(param_grid, param_distributions, n_iter, seed)
+    workers = workers or os.cpu_count() or 1
+    results = []
+    with SharedArrays(arrays) as shared, Manager() as manager:
+        board, lock = manager.dict(), manager.Lock()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(shared.specs, settings, board, lock)) as pool:
+            futures = [pool.submit(_run_trial, trial_id, params) for trial_id, params in enumerate(candidates)]
+            for future in as_completed(futures):
+                result = future.result()
+                status = 'pruned' if result['pruned'] else 'done'
+                print(f"Trial {result['trial']} {status} in {result['seconds']:.2f}s: "
+                      f"{metric}={result[metric]:.4f} {result['params']}")
+                results.append(result)
+
+    # Pruned trials stopped before their final epoch, so rank completed trials first
+    results.sort(key=lambda r: (r['pruned'], r[metric] if lower_is_better else -r[metric]))
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump({'model': model, 'metric': metric, 'trials': results}, f, indent=2)
+    return results
@@ -0,0 +1,229 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .factorModel import FactorModel
+
+
+def _csr(row_codes, col_codes, values, n_rows):
+    """Group (row, col, value) triples by row: returns indptr, cols, values"""
+    order = np.argsort(row_codes, kind='stable')
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(row_codes, minlength=n_rows), out=indptr[1:])
+    return indptr, col_codes[order], values[order]
+
+
+class MatrixFactorization:
+    """
+    Biased matrix factorization trained with alternating least squares in NumPy.
+
+    Works directly on integer-coded user/title arrays and produces the same
+    FactorModel as the Surprise SVD path, so recommenders can switch engines
+    without changing predict_rating/get_recommendations. Each half-step batches
+    users (or items) with the same number of ratings into stacked solves that
+    run on a thread pool (NumPy releases the GIL inside them).
+    """
+    def __init__(self, n_factors=100, n_epochs=20, reg=0.05, dtype=np.float32, n_threads=None,
+                 validation_fraction=0.1, patience=2, block_size=1024, max_block_elements=4_000_000,
+                 init_std_dev=0.1, rating_scale=(1, 5), random_state=None):
+        self.n_factors = n_factors
+        self.n_epochs = n_epochs
+        self.reg = reg
+        self.dtype = np.dtype(dtype)
+        self.n_threads = n_threads or os.cpu_count() or 1
+        self.validation_fraction = validation_fraction
+        self.patience = patience
+        self.block_size = block_size
+        self.max_block_elements = max_block_elements
+        self.init_std_dev = init_std_dev
+        self.rating_scale = rating_scale
+        self.random_state = random_state
+        self.model = None
+        self.user_ids = None  # Ids of the previous fit's rows, for warm starts on recoded data
+        self.title_ids = None
+        self.history = []
+
+    def _init_factors(self, rng, n_rows, previous_factors, previous_bias, previous_ids=None, ids=None):
+        """
+        Random factors / zero biases, keeping rows of a previous fit when warm-starting.
+        With ids for both fits, rows are matched by id (so reordered or recoded data
+        keeps each user's/item's own factors); otherwise by code.
+        """
+        factors = rng.normal(0, self.init_std_dev, (n_rows, self.n_factors)).astype(self.dtype)
+        bias = np.zeros(n_rows, dtype=self.dtype)
+        if previous_factors is None:
+            return factors, bias
+        if previous_ids is not None and ids is not None:
+            previous_row = {key: row for row, key in enumerate(previous_ids)}
+            rows = np.array([previous_row.get(key, -1) for key in ids], dtype=np.int64)
+            found = np.flatnonzero(rows >= 0)
+            factors[found] = previous_factors[rows[found]]
+            bias[found] = previous_bias[rows[found]]
+        else:
+            kept = min(n_rows, len(previous_factors))
+            factors[:kept] = previous_factors[:kept]
+            bias[:kept] = previous_bias[:kept]
+        return factors, bias
+
+    def _features(self, other_factors, other):
+        """Features [q_i, 1] so a row's bias is solved together with its factors"""
+        features = np.empty(other.shape + (self.n_factors + 1,), dtype=self.dtype)
+        features[..., :-1] = other_factors[other]
+        features[..., -1] = 1
+        return features
+
+    def _solve_rows(self, rows, count, indptr, cols, targets, other_factors, other_bias,
+                    out_factors, out_bias):
+        """Regularized least-squares update of rows that all have `count` ratings"""
+        dim = self.n_factors + 1
+        reg = self.dtype.type(self.reg * count)
+        positions = indptr[rows][:, None] + np.arange(count)
+        other = cols[positions]
+        features = self._features(other_factors, other)            # (rows, count, dim)
+        residual = targets[positions] - other_bias[other]          # (rows, count)
+
+        if count <= dim:
+            # Kernel form: (Y^T Y + reg I)^-1 Y^T t == Y^T (Y Y^T + reg I)^-1 t,
+            # a count x count system instead of a dim x dim one
+            kernel = features @ features.transpose(0, 2, 1)
+            kernel += reg * np.eye(count, dtype=self.dtype)
+            alpha = np.linalg.solve(kernel, residual[..., None])
+            solution = (features.transpose(0, 2, 1) @ alpha)[..., 0]
+        else:
+            gram = features.transpose(0, 2, 1) @ features
+            gram += reg * np.eye(dim, dtype=self.dtype)
+            solution = np.linalg.solve(gram, (features.transpose(0, 2, 1) @ residual[..., None]))[..., 0]
+
+        out_factors[rows] = solution[:, :-1]
+        out_bias[rows] = solution[:, -1]
+
+    def _half_step(self, pool, indptr, cols, targets, other_factors, other_bias, out_factors, out_bias):
+        """Update every row of one side; rows are batched by rating count and solved on the pool"""
+        counts = np.diff(indptr)
+        out_factors[counts == 0] = 0
+        out_bias[counts == 0] = 0
+
+        tasks = []
+        order = np.argsort(counts, kind='stable')
+        sorted_counts = counts[order]
+        bounds = np.flatnonzero(np.diff(sorted_counts)) + 1
+        for group in np.split(order, bounds):
+            count = int(counts[group[0]]) if len(group) else 0
+            if count == 0:
+                continue
+            # Cap the (rows, count, dim) feature tensor of each task
+            step = max(1, min(self.block_size, self.max_block_elements // (count * (self.n_factors + 1))))
+            for start in range(0, len(group), step):
+                tasks.append((group[start:start + step], count))
+
+        list(pool.map(
+            lambda task: self._solve_rows(*task, indptr, cols, targets, other_factors, other_bias,
+                                          out_factors, out_bias),
+            tasks
+        ))
+
+    def fit(self, user_codes, title_codes, ratings, n_users=None, n_titles=None, warm_start=False,
+            user_ids=None, title_ids=None):
+        """
+        Train on integer-coded ratings and return a FactorModel.
+
+        With validation_fraction > 0, a held-out split picks the number of epochs
+        by early stopping, then the model is refit on all ratings for that many.
+
+        Args:
+            user_codes, title_codes (array): Integer codes of each rating's user / title
+            ratings (array): Rating values
+            n_users, n_titles (int, optional): Number of codes (default: max code + 1)
+            warm_start (bool): Start from the factors of the previous fit; rows for
+                users/titles that did not exist then are initialized randomly
+            user_ids, title_ids (sequence, optional): Id of each user / title code. When
+                given here and in the previous fit, warm starts match rows by id
+                instead of by code
+        """
+        user_codes = np.asarray(user_codes, dtype=np.int64)
+        title_codes = np.asarray(title_codes, dtype=np.int64)
+        ratings = np.asarray(ratings, dtype=self.dtype)
+        n_users = n_users if n_users is not None else int(user_codes.max()) + 1
+        n_titles = n_titles if n_titles is not None else int(title_codes.max()) + 1
+        rng = np.random.default_rng(self.random_state)
+
+        # Hold out a validation split for early stopping
+        val = np.zeros(len(ratings), dtype=bool)
+        if self.validation_fraction > 0:
+            val[rng.random(len(ratings)) < self.validation_fraction] = True
+
+        previous = self.model if warm_start else None
+        initial = self._init_factors(
+            rng, n_users,
+            previous.user_factors if previous else None, previous.user_bias if previous else None,
+            self.user_ids, user_ids
+        ) + self._init_factors(
+            rng, n_titles,
+            previous.item_factors if previous else None, previous.item_bias if previous else None,
+            self.title_ids, title_ids
+        )
+        self.user_ids, self.title_ids = user_ids, title_ids
+        sizes = (n_users, n_titles)
+
+        with ThreadPoolExecutor(max_workers=self.n_threads) as pool:
+            if not val.any():
+                model, _, self.history = self._train(
+                    pool, user_codes, title_codes, ratings, sizes, initial, self.n_epochs
+                )
+            else:
+                train = ~val
+                model, best_epochs, self.history = self._train(
+                    pool, user_codes[train], title_codes[train], ratings[train], sizes, initial,
+                    self.n_epochs, validation=(user_codes[val], title_codes[val], ratings[val])
+                )
+                # The validation split only picks the number of epochs; the final
+                # model is refit from the same starting factors on every rating
+                print(f"Refitting on all {len(ratings)} ratings for {best_epochs} epochs")
+                model, _, refit = self._train(pool, user_codes, title_codes, ratings, sizes, initial, best_epochs)
+                self.history += [{**entry, 'refit': True} for entry in refit]
+
+        self.model = model
+        return self.model
+
+    def _train(self, pool, user_codes, title_codes, ratings, sizes, initial, n_epochs, validation=None):
+        """
+        Run up to n_epochs of ALS from copies of the initial (user factors, user bias,
+        item factors, item bias). With validation (user codes, title codes, ratings),
+        stops early and keeps the best epoch.
+
+        Returns:
+            tuple: (FactorModel, number of epochs it was trained for, per-epoch history)
+        """
+        n_users, n_titles = sizes
+        user_factors, user_bias, item_factors, item_bias = (array.copy() for array in initial)
+        global_mean = float(ratings.mean(dtype=np.float64))
+        centered = ratings - self.dtype.type(global_mean)
+
+        by_user = _csr(user_codes, title_codes, centered, n_users)
+        by_item = _csr(title_codes, user_codes, centered, n_titles)
+
+        model = FactorModel(global_mean, user_bias, item_bias, user_factors, item_factors, self.rating_scale)
+        best_model, best_epochs, best_rmse, bad_epochs = None, n_epochs, np.inf, 0
+        history = []
+        for epoch in range(n_epochs):
+            start_time = time.perf_counter()
+            self._half_step(pool, *by_user, item_factors, item_bias, user_factors, user_bias)
+            self._half_step(pool, *by_item, user_factors, user_bias, item_factors, item_bias)
+            entry = {'epoch': epoch + 1, 'seconds': time.perf_counter() - start_time}
+            history.append(entry)
+            if validation is None:
+                continue
+
+            entry['val_rmse'] = model.rmse(*validation)
+            if entry['val_rmse'] < best_rmse:
+                best_rmse, best_epochs, bad_epochs = entry['val_rmse'], epoch + 1, 0
+                best_model = FactorModel(global_mean, user_bias.copy(), item_bias.copy(),
+                                         user_factors.copy(), item_factors.copy(), self.rating_scale)
+            else:
+                bad_epochs += 1
+            if bad_epochs >= self.patience:
+                print(f"Early stopping after epoch {epoch + 1} (best validation RMSE {best_rmse:.4f})")
+                break
+        return best_model or model, best_epochs, history
@@ -3,15 +3,30 @@ import numpy as np
 from scipy.sparse import csr_matrix
 from sklearn.neighbors import NearestNeighbors
 from collections import defaultdict
+from .quantization import PRECISIONS, quantize
+from .ratingIndex import top_n
 
 class ProductRecommender:
-    def __init__(self, n_neighbors=6):  # 6 to get 5 recommendations (excluding the item itself)
+    def __init__(self, n_neighbors=6, precision='float64', n_popular=20, keep_events=True):  # 6 to get 5 recommendations (excluding the item itself)
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision: {precision}")
         self.n_neighbors = n_neighbors
+        self.n_popular = n_popular
+        # Without the events, get_user_history is unavailable (serve history from an EventStore)
+        self.keep_events = keep_events
+        # 'float64'/'float32' use sklearn's NearestNeighbors; 'float16'/'int8' keep the
+        # product vectors compact and search them with our own brute-force cosine
+        self.precision = precision
         self.model = NearestNeighbors(metric='cosine', n_neighbors=n_neighbors)
         self.product_user_matrix = None
+        self.product_vectors = None
+        self.product_norms = None
         self.products_dict = None
         self.product_ids = None
         self.product_idx = None
+        self.popular_product_ids = None  # Cold-start tiers, filled in by fit()
+        self.popular_by_category = None
+        self.similarity_service = None  # Shard processes answering neighbor queries (fit_sharded)
         self.df = None
 
     def preprocess_data(self, df):
@@ -28,25 +43,83 @@ class ProductRecommender:
             values='interactions'
         ).fillna(0)
 
-        # Create product mapping dictionaries
         self.product_ids = self.product_user_matrix.index
+        self._prepare_products(df)
+
+    def _prepare_products(self, df):
+        """Product mapping dictionaries and per-product info, for self.product_ids."""
         self.product_idx = {pid: idx for idx, pid in enumerate(self.product_ids)}
 
-        # Create products dictionary with additional information
-        self.products_dict = df.groupby('product_id').agg({
-            'category_id': 'first',
-            'category_code': 'first',
-            'brand': 'first'
-        }).to_dict('index')
+        # Create products dictionary with additional information (when the columns exist)
+        info_columns = [col for col in ('category_id', 'category_code', 'brand') if col in df.columns]
+        self.products_dict = df.groupby('product_id').agg(
+            {col: 'first' for col in info_columns}
+        ).to_dict('index') if info_columns else {}
 
     def fit(self, df):
         """Fit the recommendation model."""
         self.preprocess_data(df)
-        self.model.fit(self.product_user_matrix.values)
+        self.product_vectors = quantize(self.product_user_matrix.values, self.precision)
+        if self.precision in ('float16', 'int8'):
+            self.product_norms = self.product_vectors.row_norms()
+        else:
+            self.model.fit(self.product_vectors)
+        if self.precision != 'float64':
+            self.product_user_matrix = None  # Only keep the compact copy
+        self._prepare_popularity(df)
+        if not self.keep_events:
+            self.df = None
+        return self
+
+    def fit_sharded(self, df, similarity_service):
+        """
+        Fit everything except the interaction matrix, which is held by shard
+        processes instead (see similarityShards.ShardCluster); neighbor queries
+        go to similarity_service.get_similar_product_ids.
+        """
+        self.df = df
+        self.product_ids = pd.Index(np.sort(df['product_id'].unique()), name='product_id')
+        self._prepare_products(df)
+        self.similarity_service = similarity_service
+        self._prepare_popularity(df)
+        if not self.keep_events:
+            self.df = None
         return self
 
+    def _prepare_popularity(self, df):
+        """Precompute the n_popular most interacted-with products, overall and per category_code."""
+        counts = np.bincount(self.product_ids.get_indexer(df['product_id']), minlength=len(self.product_ids))
+        self.popular_product_ids = self.product_ids[top_n(counts, self.n_popular)].to_numpy()
+        
+        self.popular_by_category = {}
+        if 'category_code' not in df.columns:
+            return
+        product_categories = df.groupby('product_id')['category_code'].first().reindex(self.product_ids)
+        category_codes, categories = pd.factorize(product_categories)  # Missing categories get -1
+        # Sort by category, then by descending count (ties keep product order), and cut each group at n_popular
+        order = np.lexsort((np.arange(len(counts)), -counts, category_codes))
+        order = order[category_codes[order] >= 0]
+        sorted_codes = category_codes[order]
+        starts = np.searchsorted(sorted_codes, np.arange(len(categories)))
+        ends = np.searchsorted(sorted_codes, np.arange(len(categories)), side='right')
+        for code, category in enumerate(categories):
+            top = order[starts[code]:min(ends[code], starts[code] + self.n_popular)]
+            self.popular_by_category[category] = self.product_ids[top].to_numpy()
+
+    def get_popular_product_ids(self, n_recommendations=5, category_code=None, exclude=None):
+        """
+        Most popular products, from category_code's tier when it is known and the
+        global tier otherwise (at most n_popular).
+        """
+        popular = self.popular_by_category.get(category_code) if category_code is not None else None
+        if popular is None:
+            popular = self.popular_product_ids
+        return [pid for pid in popular if pid != exclude][:n_recommendations]
+
     def get_user_history(self, user_id):
         """Get the viewing history for a specific user."""
+        if self.df is None:
+            raise ValueError("Fitted with keep_events=False; read user history from the event store")
         user_history = self.df[self.df['user_id'] == user_id].drop_duplicates(subset=['product_id'])
         history_records = []
         for _, row in user_history.iterrows():
@@ -58,25 +131,58 @@ class ProductRecommender:
             })
         return history_records
 
-    def get_recommendations(self, product_id, n_recommendations=5):
-        """Get recommendations for a specific product."""
+    def get_similar_product_ids(self, product_id, n_recommendations=5):
+        """Get the ids of the products most similar to a product (excluding itself)."""
         if product_id not in self.product_idx:
             return []
+        if self.similarity_service is not None:
+            return self.similarity_service.get_similar_product_ids(product_id, n_recommendations)
         
         idx = self.product_idx[product_id]
-        distances, indices = self.model.kneighbors(
-            self.product_user_matrix.iloc[idx, :].values.reshape(1, -1)
-        )
+        query = self.product_vectors[idx]
+        if self.product_norms is not None:
+            indices = self._cosine_neighbors(query)
+        else:
+            distances, indices = self.model.kneighbors(query.reshape(1, -1))
+            indices = indices[0]
         
+        # Skip the first result as it's the product itself
+        return [self.product_ids[i] for i in indices[1:]][:n_recommendations]
+
+    def _cosine_neighbors(self, query):
+        """Indices of the n_neighbors products most cosine-similar to query, on the compact vectors"""
+        norms = self.product_norms * np.linalg.norm(query)
+        dots = self.product_vectors.row_dots(query)
+        similarities = np.divide(dots, norms, out=np.zeros_like(dots), where=norms > 0)
+        return top_n(similarities, self.n_neighbors)
+
+    def get_recommendations(self, product_id, n_recommendations=5, category_code=None):
+        """
+        Get recommendations for a specific product.
+        
+        Unknown products are served from the popularity tiers: category_code's
+        when given, the global one otherwise.
+        """
+        if product_id in self.product_idx:
+            product_ids = self.get_similar_product_ids(product_id, n_recommendations)
+        else:
+            product_ids = self.get_popular_product_ids(n_recommendations, category_code)
+        return self._describe_products(product_ids)
+
+    def get_popular_recommendations(self, n_recommendations=5, category_code=None):
+        """Recommendations for users without history, from the popularity tiers."""
+        return self._describe_products(self.get_popular_product_ids(n_recommendations, category_code))
+
+    def _describe_products(self, product_ids):
         similar_products = []
-        for i in range(1, len(indices[0])):  # Skip the first result as it's the product itself
-            idx = indices[0][i]
-            pid = self.product_ids[idx]
-            product_info = self.products_dict[pid]
+        for pid in product_ids:
+            # Without info columns at fit time (or with a missing value) fall back to empty fields
+            product_info = self.products_dict.get(pid, {})
+            category_code = product_info.get('category_code')
             similar_products.append({
-                'category_code': product_info['category_code'].split('.')[-1],
-                'brand': product_info['brand'],
+                'category_code': category_code.split('.')[-1] if isinstance(category_code, str) else '',
+                'brand': product_info.get('brand'),
             })
         
-        return similar_products[:n_recommendations]
+        return similar_products
 
@@ -0,0 +1,118 @@
+import numpy as np
+
+PRECISIONS = ('float64', 'float32', 'float16', 'int8')
+
+
+class QuantizedMatrix:
+    """
+    Compact 2-D matrix: float16 values, or int8 values with one float32 scale per row.
+
+    Indexing dequantizes only the selected rows/elements to float32, so code
+    written for a dense ndarray (``m[i]``, ``m[rows]``, ``m[np.ix_(rows, cols)]``)
+    keeps working while the full matrix stays in the compact form.
+    """
+    def __init__(self, values, scales=None):
+        self.values = values
+        self.scales = scales
+
+    @classmethod
+    def from_dense(cls, matrix, precision):
+        matrix = np.asarray(matrix)
+        if precision == 'float16':
+            return cls(matrix.astype(np.float16))
+        # Symmetric per-row int8: row r is stored as round(x / scale_r) with scale_r = max|x_r| / 127
+        scales = np.abs(matrix).max(axis=1).astype(np.float32) / 127
+        safe = np.where(scales > 0, scales, 1)
+        values = np.rint(matrix / safe[:, None]).astype(np.int8)
+        return cls(values, scales)
+
+    @property
+    def precision(self):
+        return 'int8' if self.scales is not None else 'float16'
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def dtype(self):
+        return np.dtype(np.float32)  # The dtype that indexing returns
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, key):
+        values = self.values[key].astype(np.float32)
+        if self.scales is None:
+            return values
+        rows = key[0] if isinstance(key, tuple) else key
+        scales = self.scales[rows]
+        if np.ndim(values) > np.ndim(scales):
+            scales = np.expand_dims(scales, -1)
+        return values * scales
+
+    def __array__(self, dtype=None, copy=None):
+        return self[:].astype(dtype or np.float32, copy=False)
+
+    def row_dots(self, vector, rows=None, block_size=4096):
+        """
+        ``matrix[rows] @ vector`` computed from the compact rows (rows=None: all rows),
+        upcasting at most block_size rows at a time.
+        """
+        values = self.values if rows is None else self.values[rows]
+        scales = self.scales if rows is None or self.scales is None else self.scales[rows]
+        vector = np.asarray(vector, dtype=np.float32)
+        dots = np.empty(len(values), dtype=np.float32)
+        for start in range(0, len(values), block_size):
+            dots[start:start + block_size] = values[start:start + block_size].astype(np.float32) @ vector
+        if scales is not None:
+            dots *= scales
+        return dots
+
+    def row_norms(self, block_size=4096):
+        """Euclidean norm of every row, upcasting at most block_size rows at a time"""
+        norms = np.empty(len(self.values), dtype=np.float32)
+        for start in range(0, len(self.values), block_size):
+            block = self.values[start:start + block_size].astype(np.float32)
+            norms[start:start + block_size] = np.sqrt(np.einsum('ij,ij->i', block, block))
+        if self.scales is not None:
+            norms *= self.scales
+        return norms
+
+
+def quantize(matrix, precision):
+    """
+    Store a dense matrix at the given precision.
+
+    'float64' / 'float32' return a plain ndarray; 'float16' / 'int8' return a
+    QuantizedMatrix.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision: {precision}")
+    if isinstance(matrix, QuantizedMatrix):
+        matrix = np.asarray(matrix)
+    if precision in ('float64', 'float32'):
+        return np.asarray(matrix, dtype=precision)
+    return QuantizedMatrix.from_dense(matrix, precision)
+
+
+def to_buffers(name, matrix):
+    """Plain arrays for a (possibly quantized) matrix, e.g. to put into shared memory"""
+    if not isinstance(matrix, QuantizedMatrix):
+        return {name: matrix}
+    buffers = {name: matrix.values}
+    if matrix.scales is not None:
+        buffers[f'{name}_scales'] = matrix.scales
+    return buffers
+
+
+def from_buffers(arrays, name):
+    """Inverse of to_buffers"""
+    values = arrays[name]
+    if values.dtype in (np.float16, np.int8):
+        return QuantizedMatrix(values, arrays.get(f'{name}_scales'))
+    return values
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+
+
+class UserRatingIndex:
+    """
+    CSR-style per-user view of a ratings table.
+
+    The ratings of the user stored in row ``r`` are
+    ``title_idx[indptr[r]:indptr[r + 1]]`` / ``ratings[indptr[r]:indptr[r + 1]]``,
+    so looking up a user's history is a dict lookup plus two array slices
+    instead of a boolean scan over the whole table.
+    """
+    def __init__(self, users, user_codes, title_codes, ratings):
+        self.users = np.asarray(users)
+        self.user_to_row = {user: row for row, user in enumerate(self.users)}
+
+        user_codes = np.asarray(user_codes, dtype=np.int64)
+        order = np.argsort(user_codes, kind='stable')  # Keep original rating order per user
+        self.title_idx = np.asarray(title_codes, dtype=np.int32)[order]
+        self.ratings = np.asarray(ratings, dtype=np.float32)[order]
+
+        counts = np.bincount(user_codes, minlength=len(self.users))
+        self.indptr = np.zeros(len(self.users) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.indptr[1:])
+
+    @classmethod
+    def from_frame(cls, df, title_to_index):
+        """Build the index from a DataFrame with user_id, title and rating columns"""
+        user_codes, users = pd.factorize(df['user_id'])
+        title_codes = df['title'].map(title_to_index).to_numpy()
+        return cls(users, user_codes, title_codes, df['rating'].to_numpy())
+
+    def __len__(self):
+        return len(self.users)
+
+    def row(self, user_id):
+        """Return the row of a user, or None for unknown users"""
+        return self.user_to_row.get(user_id)
+
+    def row_slice(self, row):
+        """Return (title indices, ratings) stored for a row"""
+        start, end = self.indptr[row], self.indptr[row + 1]
+        return self.title_idx[start:end], self.ratings[start:end]
+
+    def triples(self):
+        """Return (user rows, title indices, ratings) of every rating, grouped by user"""
+        user_rows = np.repeat(np.arange(len(self.users), dtype=np.int64), np.diff(self.indptr))
+        return user_rows, self.title_idx, self.ratings
+
+    def get(self, user_id):
+        """Return (title indices, ratings) rated by a user; empty arrays for unknown users"""
+        row = self.row(user_id)
+        if row is None:
+            return self.title_idx[:0], self.ratings[:0]
+        return self.row_slice(row)
+
+
+def content_scores(title_similarity, rated_titles, rated_ratings, candidates, default):
+    """
+    Content-based prediction for every candidate title at once.
+
+    Each prediction is the average of the user's ratings weighted by the
+    (positive) title similarity between the candidate and the rated title.
+    Candidates without any positively similar rated title, and unknown
+    candidates (index -1), get ``default``.
+    """
+    candidates = np.asarray(candidates)
+    scores = np.full(len(candidates), default, dtype=np.float64)
+    known = candidates >= 0
+    if len(rated_titles) == 0 or not known.any():
+        return scores
+
+    sims = np.asarray(title_similarity[np.ix_(candidates[known], rated_titles)], dtype=np.float64)
+    np.maximum(sims, 0, out=sims)  # Only consider positive similarities
+    weights = sims.sum(axis=1)
+    weighted = sims @ np.asarray(rated_ratings, dtype=np.float64)
+
+    has_weight = weights > 0
+    scores[known] = np.where(has_weight, weighted / np.where(has_weight, weights, 1), default)
+    return scores
+
+
+def top_n(scores, n):
+    """Indices of the n highest scores, best first; ties keep their original order"""
+    scores = np.asarray(scores)
+    if n <= 0 or len(scores) == 0:
+        return np.empty(0, dtype=np.int64)
+    if n >= len(scores):
+        return np.argsort(-scores, kind='stable')
+    part = np.argpartition(-scores, n - 1)[:n]
+    return part[np.lexsort((part, -scores[part]))]
@@ -0,0 +1,133 @@
+import json
+import random
+import sys
+from array import array
+
+import numpy as np
+import pandas as pd
+
+
+class RatingsData:
+    """
+    Integer-coded ratings table.
+
+    ``users[user_codes[i]]`` rated ``titles[title_codes[i]]`` with ``ratings[i]``.
+    Users and titles are coded in first-seen order, which matches
+    ``pd.factorize`` / ``Series.unique`` on the equivalent DataFrame.
+    """
+    def __init__(self, users, titles, user_codes, title_codes, ratings):
+        self.users = users
+        self.titles = titles
+        self.user_codes = user_codes
+        self.title_codes = title_codes
+        self.ratings = ratings
+
+    def __len__(self):
+        return len(self.ratings)
+
+    def subset(self, mask):
+        """RatingsData with only the selected ratings; users/titles are re-coded compactly"""
+        user_codes, user_uniques = pd.factorize(self.user_codes[mask])
+        title_codes, title_uniques = pd.factorize(self.title_codes[mask])
+        return RatingsData(
+            users=self.users[user_uniques],
+            titles=self.titles[title_uniques],
+            user_codes=user_codes.astype(np.int32),
+            title_codes=title_codes.astype(np.int32),
+            ratings=self.ratings[mask],
+        )
+
+    def to_frame(self):
+        """DataFrame view with categorical user_id/title columns (no per-row strings)"""
+        return pd.DataFrame({
+            'user_id': pd.Categorical.from_codes(self.user_codes, categories=self.users),
+            'title': pd.Categorical.from_codes(self.title_codes, categories=self.titles),
+            'rating': self.ratings,
+        })
+
+
+class _RatingsBuilder:
+    """Accumulates parsed JSONL user lines straight into compact code arrays"""
+    def __init__(self, first_rating_only=False):
+        self.first_rating_only = first_rating_only
+        self.user_to_code = {}
+        self.title_to_code = {}
+        self.user_codes = array('i')
+        self.title_codes = array('i')
+        self.ratings = array('f')
+
+    def _code(self, mapping, key):
+        code = mapping.get(key)
+        if code is None:
+            code = len(mapping)
+            mapping[sys.intern(key) if isinstance(key, str) else key] = code
+        return code
+
+    def add_line(self, line):
+        user_data = json.loads(line)
+        user_code = None  # Users/titles without any rating are not coded
+        for product in user_data['products']:
+            ratings = product['ratings'][:1] if self.first_rating_only else product['ratings']
+            if not ratings:
+                continue
+            if user_code is None:
+                user_code = self._code(self.user_to_code, user_data['user_id'])
+            title_code = self._code(self.title_to_code, product['title'])
+            for rating in ratings:
+                self.user_codes.append(user_code)
+                self.title_codes.append(title_code)
+                self.ratings.append(rating)
+
+    def build(self):
+        return RatingsData(
+            users=np.array(list(self.user_to_code), dtype=object),
+            titles=np.array(list(self.title_to_code), dtype=object),
+            user_codes=np.frombuffer(self.user_codes, dtype=np.int32),
+            title_codes=np.frombuffer(self.title_codes, dtype=np.int32),
+            ratings=np.frombuffer(self.ratings, dtype=np.float32),
+        )
+
+
+def read_ratings(lines, sample_size=None, first_rating_only=False, seed=None):
+    """
+    Parse JSONL user lines ({"user_id": ..., "products": [{"title", "ratings"}]})
+    into a RatingsData in a single pass.
+
+    Args:
+        lines: Iterable of JSONL lines, e.g. an open file
+        sample_size (int, optional): Keep a uniform random sample of this many
+            users (reservoir sampling, only the kept lines are parsed)
+        first_rating_only (bool): Keep only the first rating per product
+        seed (int, optional): Seed for the user sample
+    """
+    builder = _RatingsBuilder(first_rating_only)
+
+    if not sample_size:
+        for line in lines:
+            if line.strip():
+                builder.add_line(line)
+        return builder.build()
+
+    rng = random.Random(seed)
+    reservoir = []
+    seen = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        if seen < sample_size:
+            reservoir.append(line)
+        else:
+            slot = rng.randrange(seen + 1)
+            if slot < sample_size:
+                reservoir[slot] = line
+        seen += 1
+
+    for line in reservoir:
+        builder.add_line(line)
+    return builder.build()
+
+
+def load_ratings_jsonl(jsonl_path, sample_size=None, first_rating_only=False, seed=None):
+    """Stream a JSONL ratings file from disk into a RatingsData"""
+    with open(jsonl_path, 'r', encoding='utf-8') as f:
+        return read_ratings(f, sample_size=sample_size, first_rating_only=first_rating_only, seed=seed)
@@ -0,0 +1,73 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Keeps attached blocks alive in worker processes for as long as the views are used
+_attached_blocks = []
+
+
+class SharedArrays:
+    """
+    Named NumPy arrays copied once into shared memory blocks.
+
+    ``specs`` is a small picklable description (block name, shape, dtype per
+    array) that worker processes pass to ``attach_arrays`` to get zero-copy
+    views, instead of every worker receiving its own pickled copy.
+    """
+    def __init__(self, arrays):
+        self.blocks = []
+        self.arrays = {}
+        self.specs = {}
+        try:
+            for key, value in arrays.items():
+                value = np.ascontiguousarray(value)
+                if value.dtype == object:
+                    raise TypeError(f"Array '{key}' has dtype object and cannot be shared")
+                block = shared_memory.SharedMemory(create=True, size=max(value.nbytes, 1))
+                self.blocks.append(block)
+                view = np.ndarray(value.shape, dtype=value.dtype, buffer=block.buf)
+                view[...] = value
+                self.arrays[key] = view
+                self.specs[key] = (block.name, value.shape, value.dtype.str)
+        except Exception:
+            self.close()
+            raise
+
+    def __getitem__(self, key):
+        return self.arrays[key]
+
+    def close(self):
+        """Release and unlink all blocks (call from the creating process only)"""
+        self.arrays = {}
+        for block in self.blocks:
+            try:
+                block.close()
+            except BufferError:
+                pass  # A caller still holds a view; the mapping goes away with it
+            block.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _attach_block(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13: pool workers share the parent's resource tracker,
+        # so registering the block again is harmless
+        return shared_memory.SharedMemory(name=name)
+
+
+def attach_arrays(specs):
+    """Return zero-copy views of arrays shared by SharedArrays, given its specs"""
+    arrays = {}
+    for key, (name, shape, dtype) in specs.items():
+        block = _attach_block(name)
+        _attached_blocks.append(block)
+        arrays[key] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+    return arrays
@@ -0,0 +1,241 @@
+import json
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.preprocessing import normalize
+
+from .ratingIndex import top_n
+
+
+def shard_of(product_id, n_shards):
+    """Shard that owns a product (stable across processes, unlike hash())"""
+    return zlib.crc32(str(product_id).encode()) % n_shards
+
+
+def build_shards(df, n_shards, path):
+    """
+    Partition the product-user interaction matrix into n_shards files under path.
+
+    Rows are l2-normalized interaction counts, so a shard's cosine similarities
+    to a query are a single sparse matrix-vector product. Each shard file only
+    holds its own products' rows.
+    """
+    user_codes, users = pd.factorize(df['user_id'])
+    product_codes, product_ids = pd.factorize(df['product_id'], sort=True)  # Sorted like the pivot
+    matrix = sparse.csr_matrix(
+        (np.ones(len(df), dtype=np.float32), (product_codes, user_codes)),
+        shape=(len(product_ids), len(users))
+    )
+    matrix.sum_duplicates()
+    matrix = normalize(matrix)
+
+    os.makedirs(path, exist_ok=True)
+    owners = np.array([shard_of(pid, n_shards) for pid in product_ids])
+    for shard in range(n_shards):
+        rows = np.flatnonzero(owners == shard)
+        sparse.save_npz(os.path.join(path, f'shard-{shard}.npz'), matrix[rows])
+        np.save(os.path.join(path, f'shard-{shard}-ids.npy'), product_ids.to_numpy()[rows])
+    with open(os.path.join(path, 'shards.json'), 'w', encoding='utf-8') as f:
+        json.dump({'n_shards': n_shards, 'n_users': len(users), 'n_products': len(product_ids)}, f)
+
+
+class SimilarityShard:
+    """The products of one shard: look up their vectors and find local nearest neighbors"""
+    def __init__(self, path, shard):
+        self.matrix = sparse.load_npz(os.path.join(path, f'shard-{shard}.npz')).tocsr()
+        self.product_ids = np.load(os.path.join(path, f'shard-{shard}-ids.npy'), allow_pickle=True)
+        self.product_idx = {pid: idx for idx, pid in enumerate(self.product_ids.tolist())}
+
+    def vector(self, product_id):
+        """(user indices, values) of a product's normalized vector, or None if not in this shard"""
+        idx = self.product_idx.get(product_id)
+        if idx is None:
+            return None
+        start, end = self.matrix.indptr[idx], self.matrix.indptr[idx + 1]
+        return self.matrix.indices[start:end], self.matrix.data[start:end]
+
+    def top_k(self, indices, values, k):
+        """(product ids, cosine similarities) of this shard's k products closest to the query"""
+        query = np.zeros(self.matrix.shape[1], dtype=np.float32)
+        query[indices] = values
+        similarities = self.matrix @ query
+        best = top_n(similarities, k)
+        return self.product_ids[best], similarities[best]
+
+
+def _handle_connection(shard, conn):
+    with conn:
+        while True:
+            try:
+                message = conn.recv()
+            except EOFError:
+                return
+            if message[0] == 'vector':
+                conn.send(shard.vector(message[1]))
+            elif message[0] == 'top_k':
+                conn.send(shard.top_k(*message[1:]))
+
+
+def serve_shard(path, shard, address, family, authkey, ready):
+    """Shard process: load one shard and answer router queries on a Unix or loopback socket"""
+    shard_data = SimilarityShard(path, shard)
+    with Listener(address, family=family, authkey=authkey) as listener:
+        ready.send(listener.address)
+        ready.close()
+        while True:
+            conn = listener.accept()
+            threading.Thread(target=_handle_connection, args=(shard_data, conn), daemon=True).start()
+
+
+class ShardRouter:
+    """
+    Client side of the shard processes.
+
+    A query goes to the product's owner shard for its vector, then fans out to
+    every shard in parallel; the partial top-k lists are merged by similarity.
+    Connections are pooled per shard so concurrent requests don't share one.
+    """
+    def __init__(self, addresses, authkey, pool_size=8):
+        self.addresses = addresses
+        self.authkey = authkey
+        self._pools = [queue.LifoQueue() for _ in addresses]
+        self._executor = ThreadPoolExecutor(max_workers=max(1, pool_size * len(addresses)))
+
+    def _call(self, shard, message):
+        pool = self._pools[shard]
+        try:
+            conn = pool.get_nowait()
+        except queue.Empty:
+            conn = Client(self.addresses[shard], authkey=self.authkey)
+        try:
+            conn.send(message)
+            result = conn.recv()
+        except Exception:
+            conn.close()
+            raise
+        pool.put(conn)
+        return result
+
+    def get_similar_product_ids(self, product_id, n_recommendations=5):
+        """Ids of the products most similar to product_id (excluding itself); [] if unknown"""
+        vector = self._call(shard_of(product_id, len(self.addresses)), ('vector', product_id))
+        if vector is None:
+            return []
+        # One extra per shard, since the product itself is found by its owner
+        futures = [
+            self._executor.submit(self._call, shard, ('top_k', *vector, n_recommendations + 1))
+            for shard in range(len(self.addresses))
+        ]
+        results = [future.result() for future in futures]
+        ids = np.concatenate([ids for ids, _ in results])
+        similarities = np.concatenate([sims for _, sims in results])
+        keep = ids != product_id
+        ids, similarities = ids[keep], similarities[keep]
+        best = top_n(similarities, n_recommendations)
+        return ids[best].tolist()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        for pool in self._pools:
+            while not pool.empty():
+                pool.get_nowait().close()
+
+
+class ShardCluster:
+    """
+    Start one process per shard of a build_shards directory and route queries to them.
+
+    Args:
+        path (str): Directory written by build_shards
+        family (str): 'AF_UNIX' (sockets in a temporary directory) or 'AF_INET' (127.0.0.1)
+        authkey (bytes, optional): Shared secret for the connections (default: random)
+    """
+    def __init__(self, path, family='AF_UNIX', authkey=None):
+        self.path = path
+        self.family = family
+        with open(os.path.join(path, 'shards.json'), 'r', encoding='utf-8') as f:
+            self.info = json.load(f)
+        self._start(authkey or os.urandom(16))
+
+    def _start(self, authkey):
+        self.socket_dir = tempfile.mkdtemp(prefix='shards-') if self.family == 'AF_UNIX' else None
+        self.processes, addresses = [], []
+        try:
+            for shard in range(self.info['n_shards']):
+                if self.family == 'AF_UNIX':
+                    address = os.path.join(self.socket_dir, f'shard-{shard}.sock')
+                else:
+                    address = ('127.0.0.1', 0)  # The shard reports the port it got
+                receiver, sender = Pipe(duplex=False)
+                process = Process(target=serve_shard, name=f'similarity-shard-{shard}', daemon=True,
+                                  args=(self.path, shard, address, self.family, authkey, sender))
+                process.start()
+                self.processes.append(process)
+                addresses.append(receiver.recv())
+        except Exception:
+            self.close()
+            raise
+        self.router = ShardRouter(addresses, authkey)
+        print(f"Started {len(self.processes)} similarity shards for {self.info['n_products']} products")
+
+    def get_similar_product_ids(self, product_id, n_recommendations=5):
+        return self.router.get_similar_product_ids(product_id, n_recommendations)
+
+    def close(self):
+        router = getattr(self, 'router', None)
+        if router is not None:
+            router.close()
+        for process in self.processes:
+            process.terminate()
+            process.join()
+        if self.socket_dir:
+            shutil.rmtree(self.socket_dir, ignore_errors=True)
+
+    def __getstate__(self):
+        return {'path': self.path, 'family': self.family}  # Processes restart when unpickled
+
+    def __setstate__(self, state):
+        self.__init__(state['path'], state['family'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def benchmark_shards(df, shard_counts=(1, 2, 4), n_queries=2000, concurrency=8, k=5,
+                     family='AF_UNIX', seed=42):
+    """
+    Queries/sec of sharded similarity serving for each number of shards,
+    with `concurrency` client threads issuing random product queries.
+    """
+    product_ids = df['product_id'].unique()
+    queries = np.random.default_rng(seed).choice(product_ids, n_queries)
+    results = {}
+    for n_shards in shard_counts:
+        path = tempfile.mkdtemp(prefix='shard-data-')
+        try:
+            build_shards(df, n_shards, path)
+            with ShardCluster(path, family) as cluster:
+                cluster.get_similar_product_ids(queries[0], k)  # Open connections
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                    list(pool.map(lambda pid: cluster.get_similar_product_ids(pid, k), queries))
+                elapsed = time.perf_counter() - start
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+        results[n_shards] = n_queries / elapsed
+        print(f"{n_shards} shard(s): {results[n_shards]:.0f} queries/sec")
+    return results
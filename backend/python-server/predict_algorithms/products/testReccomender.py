@@ -3,8 +3,17 @@ import pandas as pd
 from .hybridReccomender import HybridRecommender
 from .enhencedRecommender import EnhancedRecommender
 from .productRecommender import ProductRecommender
+from .ratingsLoader import load_ratings_jsonl
+from .factorModel import FactorModel
+from .matrixFactorization import MatrixFactorization
+from .quantization import quantize
+from surprise import SVD, Reader, Dataset
+import copy
 import datetime
+import time
+import tracemalloc
 import numpy as np
+from collections import defaultdict
 
 def load_and_test_recommender(jsonl_path, sample_size=None):
     """
@@ -14,25 +23,11 @@ def load_and_test_recommender(jsonl_path, sample_size=None):
         jsonl_path (str): Path to the JSONL file
         sample_size (int, optional): Number of users to sample for testing
     """
-    # Read JSONL file and combine into a single string for the recommender
+    # Stream the JSONL file straight into integer-coded arrays
     print("Loading data...")
-    all_data = []
-    with open(jsonl_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            if line.strip():
-                all_data.append(line.strip())
-    
-    if sample_size:
-        # Randomly sample users if sample_size is specified
-        import random
-        all_data = random.sample(all_data, min(sample_size, len(all_data)))
-    
-    combined_data = '\n'.join(all_data)
-    
-    # Initialize and train recommender
     print("Initializing recommender system...")
     recommender = EnhancedRecommender()  # Updated class name
-    recommender.load_data(combined_data)
+    recommender.load_jsonl(jsonl_path, sample_size=sample_size)
     
     print("\nStarting training...")
     recommender.train()
@@ -76,6 +71,49 @@ def load_and_test_recommender(jsonl_path, sample_size=None):
     
     return recommender
 
+def compare_training_engines(jsonl_path, sample_size=None, test_fraction=0.1, seed=42):
+    """
+    Compare Surprise SVD against the native NumPy factorization engine
+    on the same ratings: training time and holdout RMSE.
+    
+    Args:
+        jsonl_path (str): Path to the JSONL file
+        sample_size (int, optional): Number of users to sample
+        test_fraction (float): Fraction of ratings held out for RMSE
+        seed (int): Seed for the user sample and the holdout split
+    """
+    data = load_ratings_jsonl(jsonl_path, sample_size=sample_size, seed=seed)
+    test = np.random.default_rng(seed).random(len(data)) < test_fraction
+    
+    def holdout_rmse(model):
+        return model.rmse(data.user_codes[test], data.title_codes[test], data.ratings[test])
+    
+    results = {}
+    
+    # Surprise needs a DataFrame of raw ids
+    df = data.to_frame()[~test]
+    trainset = Dataset.load_from_df(df[['user_id', 'title', 'rating']], Reader(rating_scale=(1, 5))).build_full_trainset()
+    svd = SVD(n_factors=100, n_epochs=20, lr_all=0.005, reg_all=0.02, random_state=seed)
+    start = time.perf_counter()
+    svd.fit(trainset)
+    elapsed = time.perf_counter() - start
+    model = FactorModel.from_surprise(svd, trainset, data.users, data.titles)
+    results['surprise'] = {'train_seconds': elapsed, 'rmse': holdout_rmse(model)}
+    
+    # Native engine trains on the integer codes directly; its early stopping split is
+    # carved from the same training ratings and it refits on all of them afterwards
+    mf = MatrixFactorization(n_factors=100, n_epochs=20, random_state=seed)
+    start = time.perf_counter()
+    model = mf.fit(data.user_codes[~test], data.title_codes[~test], data.ratings[~test],
+                   n_users=len(data.users), n_titles=len(data.titles))
+    elapsed = time.perf_counter() - start
+    results['native'] = {'train_seconds': elapsed, 'rmse': holdout_rmse(model)}
+    
+    print(f"\nTraining engines on {int((~test).sum())} ratings ({int(test.sum())} held out):")
+    for engine, result in results.items():
+        print(f"- {engine}: {result['train_seconds']:.2f}s, holdout RMSE {result['rmse']:.4f}")
+    return results
+
 def load_and_prepare_data(file_path):
     """Load and prepare the dataset."""
     df = pd.read_csv(file_path)
@@ -86,8 +124,9 @@ def print_product_list(products, title):
     print(f"\n{title}")
     print("-" * 80)
     for i, product in enumerate(products, 1):
-        print(f"{i}. Product ID: {product['product_id']}")
-        print(f"   Category ID: {product['category_id']}")
+        # Recommendations only carry category_code and brand
+        print(f"{i}. Product ID: {product.get('product_id', '-')}")
+        print(f"   Category ID: {product.get('category_id', '-')}")
         print(f"   Category Code: {product['category_code']}")
         print(f"   Brand: {product['brand']}")
         if 'similarity_score' in product:
@@ -98,8 +137,10 @@ def print_product_list(products, title):
 
 
 def load_csv_data_and_test_recommender(csv_path, sample_size=None, test_size=0.2):
-    # Load the data
-    df = pd.read_csv(csv_path)
+    # Load the data, optionally sampling users, and keep a test split aside
+    events = sample_users(pd.read_csv(csv_path), sample_size)
+    test = split_mask(len(events), test_size)
+    df = events[~test]
     
     # Initialize and train the recommender
     recommender = ProductRecommender()
@@ -115,4 +156,315 @@ def load_csv_data_and_test_recommender(csv_path, sample_size=None, test_size=0.2
     # Get and print recommendations based on the last viewed product
     last_viewed_product = user_history[-1]['product_id']
     recommendations = recommender.get_recommendations(last_viewed_product, n_recommendations=5)
-    print_product_list(recommendations, f"Top 5 Recommendations based on last viewed product {last_viewed_product}")
\ No newline at end of file
+    print_product_list(recommendations, f"Top 5 Recommendations based on last viewed product {last_viewed_product}")
+    
+    # Score the same kind of recommendations against the held-out events
+    print_evaluation('ProductRecommender', evaluate_product_recommender(events, test=test), 5)
+
+def split_mask(n_events, test_size=0.2, method='holdout', times=None, seed=42):
+    """
+    Boolean mask of the events that go to the test set.
+    
+    Args:
+        n_events (int): Number of events
+        test_size (float): Fraction of events in the test set
+        method (str): 'holdout' for a random split, 'time' to put the latest events in the test set
+        times (array, optional): Event timestamps, required for method='time'
+        seed (int): Seed for the random split
+    """
+    if method == 'holdout':
+        return np.random.default_rng(seed).random(n_events) < test_size
+    if method == 'time':
+        if times is None:
+            raise ValueError("A time split needs event timestamps")
+        times = pd.to_datetime(pd.Series(times))
+        return (times > times.quantile(1 - test_size)).to_numpy()
+    raise ValueError(f"Unknown split method: {method}")
+
+def sample_users(df, sample_size, seed=42):
+    """Keep the events of sample_size randomly chosen users."""
+    if not sample_size:
+        return df
+    users = df['user_id'].unique()
+    chosen = np.random.default_rng(seed).choice(users, min(sample_size, len(users)), replace=False)
+    return df[df['user_id'].isin(chosen)]
+
+def measure_fit(fit):
+    """Run fit() and return (result, seconds, peak traced memory in MB)."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = fit()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak / 2**20
+
+def evaluate_queries(queries, recommend, k, catalog_size):
+    """
+    Run recommend(query) for every (query, relevant_items) pair and compute
+    precision@k, recall@k, catalog coverage and per-query latency percentiles.
+    """
+    precisions, recalls, latencies = [], [], []
+    recommended_items = set()
+    for query, relevant in queries:
+        start = time.perf_counter()
+        recommended = recommend(query)[:k]
+        latencies.append((time.perf_counter() - start) * 1000)
+        
+        hits = len(set(recommended) & relevant)
+        precisions.append(hits / k)
+        recalls.append(hits / len(relevant))
+        recommended_items.update(recommended)
+    
+    if not latencies:
+        return {'users_evaluated': 0}
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    return {
+        'users_evaluated': len(latencies),
+        f'precision@{k}': float(np.mean(precisions)),
+        f'recall@{k}': float(np.mean(recalls)),
+        'coverage': len(recommended_items) / catalog_size if catalog_size else 0.0,
+        'latency_ms': {'mean': float(np.mean(latencies)), 'p50': float(p50), 'p90': float(p90), 'p99': float(p99)},
+    }
+
+def _pick_users(users, max_users, seed):
+    users = list(users)
+    if max_users and len(users) > max_users:
+        rng = np.random.default_rng(seed)
+        users = [users[i] for i in sorted(rng.choice(len(users), max_users, replace=False))]
+    return users
+
+def print_evaluation(name, result, k):
+    """Print one model's evaluation result on a single line."""
+    if not result.get('users_evaluated'):
+        print(f"{name}: no users to evaluate")
+        return
+    print(f"{name}: precision@{k} {result[f'precision@{k}']:.4f}, recall@{k} {result[f'recall@{k}']:.4f}, "
+          f"coverage {result['coverage']:.3f}, fit {result['fit_seconds']:.2f}s / {result['peak_memory_mb']:.1f}MB, "
+          f"p50 {result['latency_ms']['p50']:.2f}ms, p99 {result['latency_ms']['p99']:.2f}ms")
+
+def evaluate_product_recommender(df, k=5, test_size=0.2, split='holdout', max_users=500, seed=42, test=None):
+    """
+    Evaluate ProductRecommender on an events DataFrame (user_id, product_id, ...).
+    A boolean test mask over df's rows, if given, replaces the test_size/split split.
+    """
+    if test is None:
+        test = split_mask(len(df), test_size, split, df['event_time'] if split == 'time' else None, seed)
+    train_df, test_df = df[~test], df[test]
+    
+    recommender, fit_seconds, peak_mb = measure_fit(
+        lambda: ProductRecommender(n_neighbors=k + 1).fit(train_df)
+    )
+    
+    # Query with the user's last training event, like /get_recommendation does
+    last_viewed = train_df.groupby('user_id')['product_id'].last()
+    seen = train_df.groupby('user_id')['product_id'].agg(set)
+    test_products = test_df.groupby('user_id')['product_id'].agg(set)
+    queries = []
+    for user_id in _pick_users(test_products.index.intersection(last_viewed.index), max_users, seed):
+        relevant = test_products[user_id] - seen[user_id]
+        if relevant:
+            queries.append((last_viewed[user_id], relevant))
+    
+    result = evaluate_queries(
+        queries, lambda pid: recommender.get_similar_product_ids(pid, k), k, len(recommender.product_ids)
+    )
+    result.update(fit_seconds=fit_seconds, peak_memory_mb=peak_mb)
+    return result
+
+def evaluate_rating_recommender(recommender_cls, data, k=5, test_size=0.2, max_users=500, seed=42, **kwargs):
+    """Evaluate HybridRecommender / EnhancedRecommender on RatingsData with a holdout split."""
+    test = split_mask(len(data), test_size, 'holdout', seed=seed)
+    train_data = data.subset(~test)
+    
+    def fit():
+        recommender = recommender_cls(**kwargs)
+        recommender.load_ratings(train_data)
+        recommender.train()
+        return recommender
+    
+    recommender, fit_seconds, peak_mb = measure_fit(fit)
+    
+    # Relevant items: held-out titles the user has not rated in the training set
+    test_titles = defaultdict(set)
+    for user_code, title_code in zip(data.user_codes[test], data.title_codes[test]):
+        test_titles[data.users[user_code]].add(data.titles[title_code])
+    queries = []
+    for user_id in _pick_users(test_titles, max_users, seed):
+        rated_titles, _ = recommender.user_index.get(user_id)
+        if len(rated_titles) == 0:
+            continue
+        relevant = test_titles[user_id] - set(recommender.titles[rated_titles])
+        if relevant:
+            queries.append((user_id, relevant))
+    
+    result = evaluate_queries(
+        queries,
+        lambda user_id: [title for title, _ in recommender.get_recommendations(user_id, n=k)],
+        k, len(recommender.titles)
+    )
+    result.update(fit_seconds=fit_seconds, peak_memory_mb=peak_mb)
+    return result
+
+def evaluate_recommenders(csv_path=None, jsonl_path=None, k=5, test_size=0.2, split='holdout',
+                          sample_size=None, max_users=500, report_path='evaluation_report.json',
+                          engine='surprise', seed=42):
+    """
+    Offline evaluation of the recommenders, written to a JSON report.
+    
+    ProductRecommender is evaluated on the events CSV (holdout or time split);
+    HybridRecommender and EnhancedRecommender on the ratings JSONL (holdout split,
+    the JSONL carries no timestamps).
+    
+    Args:
+        csv_path (str, optional): Events CSV for ProductRecommender
+        jsonl_path (str, optional): Ratings JSONL for the hybrid recommenders
+        k (int): Cut-off for precision@k / recall@k
+        test_size (float): Fraction of events held out
+        split (str): 'holdout' or 'time' (CSV only)
+        sample_size (int, optional): Number of users to sample from each dataset
+        max_users (int, optional): Number of users to query per model
+        report_path (str): Where to write the JSON report
+        engine (str): Training engine for the hybrid recommenders ('surprise' or 'native')
+        seed (int): Seed for sampling and splitting
+    """
+    report = {
+        'config': {'k': k, 'test_size': test_size, 'split': split, 'sample_size': sample_size,
+                   'max_users': max_users, 'engine': engine, 'seed': seed},
+        'models': {},
+    }
+    
+    if csv_path:
+        df = sample_users(pd.read_csv(csv_path), sample_size, seed)
+        print("Evaluating ProductRecommender...")
+        report['models']['ProductRecommender'] = evaluate_product_recommender(
+            df, k, test_size, split, max_users, seed
+        )
+    
+    if jsonl_path:
+        data = load_ratings_jsonl(jsonl_path, sample_size=sample_size, seed=seed)
+        enhanced_data = load_ratings_jsonl(jsonl_path, sample_size=sample_size, first_rating_only=True, seed=seed)
+        for recommender_cls, cls_data in ((HybridRecommender, data), (EnhancedRecommender, enhanced_data)):
+            print(f"Evaluating {recommender_cls.__name__}...")
+            report['models'][recommender_cls.__name__] = evaluate_rating_recommender(
+                recommender_cls, cls_data, k, test_size, max_users, seed, engine=engine
+            )
+    
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    
+    for name, result in report['models'].items():
+        print_evaluation(name, result, k)
+    print(f"Report written to {report_path}")
+    return report
+
+def ranking_agreement(reference, candidate):
+    """Overlap@k of two top-k lists and the fraction of positions that match exactly."""
+    if not reference:
+        return 1.0, 1.0
+    overlap = len(set(reference) & set(candidate)) / len(reference)
+    same_position = sum(a == b for a, b in zip(reference, candidate)) / len(reference)
+    return overlap, same_position
+
+def _agreement_summary(pairs, base_bytes, compact_bytes):
+    overlaps, positions = zip(*(ranking_agreement(ref, cand) for ref, cand in pairs)) if pairs else ((), ())
+    return {
+        'memory_mb': compact_bytes / 2**20,
+        'memory_saving': 1 - compact_bytes / base_bytes if base_bytes else 0.0,
+        'overlap@k': float(np.mean(overlaps)) if overlaps else None,
+        'same_position@k': float(np.mean(positions)) if positions else None,
+    }
+
+def retained_model_bytes(recommender):
+    """
+    Bytes of the model arrays a trained HybridRecommender / EnhancedRecommender
+    keeps: title similarities, factors, and any copy still held by the training engine
+    """
+    total = recommender.title_similarity.nbytes + recommender.factors.nbytes
+    total += sum(array.nbytes for array in (getattr(recommender.svd, name, None) for name in ('pu', 'qi', 'bu', 'bi'))
+                 if array is not None)
+    if recommender.mf.model is not None and recommender.mf.model is not recommender.factors:
+        total += recommender.mf.model.nbytes
+    return total
+
+def compare_precisions(csv_path=None, jsonl_path=None, k=5, sample_size=None, max_queries=200,
+                       precisions=('float32', 'float16', 'int8'), engine='surprise', seed=42,
+                       report_path='precision_report.json'):
+    """
+    Measure the memory saved by reduced-precision storage and how closely the
+    rankings match float64.
+    
+    ProductRecommender is refitted at every precision and compared on the
+    product-user vectors; HybridRecommender / EnhancedRecommender are trained
+    once and their title_similarity and factor matrices requantized, compared
+    on get_recommendations. Memory is everything the trained model retains
+    (retained_model_bytes), including any training-engine copy of the factors.
+    
+    Args:
+        csv_path (str, optional): Events CSV for ProductRecommender
+        jsonl_path (str, optional): Ratings JSONL for the hybrid recommenders
+        k (int): Length of the compared rankings
+        sample_size (int, optional): Number of users to sample from each dataset
+        max_queries (int): Number of products / users to compare per model
+        precisions (tuple): Precisions to compare against float64
+        engine (str): Training engine for the hybrid recommenders
+        seed (int): Seed for sampling
+        report_path (str): Where to write the JSON report
+    """
+    report = {'config': {'k': k, 'sample_size': sample_size, 'max_queries': max_queries, 'engine': engine},
+              'models': {}}
+    
+    if csv_path:
+        df = sample_users(pd.read_csv(csv_path), sample_size, seed)
+        base = ProductRecommender(n_neighbors=k + 1).fit(df)
+        base_bytes = base.product_vectors.nbytes
+        products = _pick_users(base.product_ids, max_queries, seed)
+        reference = [base.get_similar_product_ids(pid, k) for pid in products]
+        results = {'float64': {'memory_mb': base_bytes / 2**20}}
+        for precision in precisions:
+            compact = ProductRecommender(n_neighbors=k + 1, precision=precision).fit(df)
+            pairs = list(zip(reference, (compact.get_similar_product_ids(pid, k) for pid in products)))
+            results[precision] = _agreement_summary(pairs, base_bytes, compact.product_vectors.nbytes)
+        report['models']['ProductRecommender'] = results
+    
+    if jsonl_path:
+        for recommender_cls, first_rating_only in ((HybridRecommender, False), (EnhancedRecommender, True)):
+            print(f"Training {recommender_cls.__name__}...")
+            base = recommender_cls(engine=engine)
+            base.load_ratings(load_ratings_jsonl(
+                jsonl_path, sample_size=sample_size, first_rating_only=first_rating_only, seed=seed
+            ))
+            base.train()
+            base_bytes = retained_model_bytes(base)
+            users = _pick_users(base.user_index.users, max_queries, seed)
+            reference = [[title for title, _ in base.get_recommendations(user_id, k)] for user_id in users]
+            results = {'float64': {'memory_mb': base_bytes / 2**20}}
+            for precision in precisions:
+                # Same trained model, only the storage precision differs
+                compact = copy.copy(base)
+                compact.mf = copy.copy(base.mf)  # _set_factors replaces the engine's model; keep base's intact
+                compact.precision = precision
+                compact.title_similarity = quantize(base.title_similarity, precision)
+                compact._set_factors(base.factors)
+                recommended = ([title for title, _ in compact.get_recommendations(user_id, k)] for user_id in users)
+                results[precision] = _agreement_summary(
+                    list(zip(reference, recommended)), base_bytes, retained_model_bytes(compact)
+                )
+            report['models'][recommender_cls.__name__] = results
+    
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    
+    for name, results in report['models'].items():
+        print(f"{name}: float64 {results['float64']['memory_mb']:.1f}MB")
+        for precision in precisions:
+            result = results[precision]
+            if result['overlap@k'] is None:
+                print(f"  {precision}: {result['memory_mb']:.1f}MB ({result['memory_saving']:.0%} smaller)")
+                continue
+            print(f"  {precision}: {result['memory_mb']:.1f}MB ({result['memory_saving']:.0%} smaller), "
+                  f"overlap@{k} {result['overlap@k']:.3f}, same position {result['same_position@k']:.3f}")
+    print(f"Report written to {report_path}")
+    return report
@@ -0,0 +1,149 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.sparse import vstack
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+
+from .quantization import QuantizedMatrix
+
+
+class HashingTitleVectorizer:
+    """
+    TF-IDF title vectors without a vocabulary.
+
+    Terms are mapped to columns by feature hashing, which is stateless, so any
+    batch of titles can be hashed independently (in another process, or long
+    after the first fit). The only state is the per-column document frequency,
+    a fixed-size count array that batches simply add to. Weighting matches
+    TfidfVectorizer's defaults: smooth idf and l2-normalized rows.
+    """
+    def __init__(self, n_features=2**18, stop_words='english'):
+        self.n_features = n_features
+        self.hasher = HashingVectorizer(
+            n_features=n_features, stop_words=stop_words, alternate_sign=False, norm=None
+        )
+        self.doc_counts = np.zeros(n_features, dtype=np.int64)
+        self.n_docs = 0
+
+    def hash(self, titles, batch_size=None, workers=None):
+        """
+        Raw term counts of titles (sparse, one row per title).
+
+        Args:
+            batch_size (int, optional): Titles per batch (default: all at once)
+            workers (int, optional): Hash batches in this many processes
+        """
+        titles = list(titles)
+        if not batch_size or len(titles) <= batch_size:
+            return self.hasher.transform(titles)
+        batches = [titles[start:start + batch_size] for start in range(0, len(titles), batch_size)]
+        if workers == 1:
+            return vstack([self.hasher.transform(batch) for batch in batches], format='csr')
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+            return vstack(list(pool.map(self.hasher.transform, batches)), format='csr')
+
+    def update_counts(self, term_counts):
+        """Add hashed titles to the document frequency counts"""
+        term_counts = term_counts.tocsr()
+        term_counts.sum_duplicates()
+        self.doc_counts += np.bincount(term_counts.indices, minlength=self.n_features)
+        self.n_docs += term_counts.shape[0]
+
+    def merge(self, other):
+        """Add the document frequency counts of a vectorizer that saw other titles"""
+        if other.n_features != self.n_features:
+            raise ValueError("Cannot merge vectorizers with different n_features")
+        self.doc_counts += other.doc_counts
+        self.n_docs += other.n_docs
+
+    @property
+    def idf(self):
+        return np.log((1 + self.n_docs) / (1 + self.doc_counts)) + 1
+
+    def weight(self, term_counts):
+        """TF-IDF weight and l2-normalize hashed term counts with the current document frequencies"""
+        return normalize(term_counts.tocsr().multiply(self.idf).tocsr())
+
+    def partial_fit_transform(self, titles, batch_size=None, workers=None):
+        """Count a new batch of titles, then return their vectors"""
+        term_counts = self.hash(titles, batch_size, workers)
+        self.update_counts(term_counts)
+        return self.weight(term_counts)
+
+    def fit_transform(self, titles, batch_size=None, workers=None):
+        """Reset the counts and vectorize titles, like TfidfVectorizer.fit_transform"""
+        self.doc_counts[:] = 0
+        self.n_docs = 0
+        return self.partial_fit_transform(titles, batch_size, workers)
+
+    def transform(self, titles):
+        """Vectorize titles without counting them"""
+        return self.weight(self.hash(titles))
+
+
+
+# Spare cells kept when an extended similarity matrix outgrows its buffer. Rows and
+# columns each grow by the square root, so the buffer is at most this many times
+# the cells in use
+GROWTH_FACTOR = 1.25
+
+# add_titles() re-weights the whole catalog once it has grown by this fraction since
+# titles were last vectorized together (see extend_similarity on idf drift)
+REWEIGHT_AFTER = 0.25
+
+
+def _grow(array, shape, buffer=None):
+    """
+    ``array`` enlarged to ``shape`` (new cells uninitialized), and the buffer it
+    is a view of. The caller keeps the buffer alongside the array; when array
+    starts the buffer and fits, nothing is copied. Otherwise a buffer with
+    GROWTH_FACTOR spare cells is allocated, so n single-title additions copy
+    O(n) matrices' worth of cells in total instead of O(n²). Cells outside
+    array are the only ones written, so array stays valid.
+    """
+    reusable = (buffer is not None and array.ctypes.data == buffer.ctypes.data
+                and array.strides == buffer.strides
+                and all(size <= capacity for size, capacity in zip(shape, buffer.shape)))
+    if not reusable:
+        spare = GROWTH_FACTOR ** (1 / len(shape))
+        buffer = np.empty(tuple(max(size, int(size * spare)) for size in shape), dtype=array.dtype)
+        buffer[tuple(slice(0, size) for size in array.shape)] = array
+    return buffer[tuple(slice(0, size) for size in shape)], buffer
+
+
+def extend_similarity(similarity, cross, spare=None):
+    """
+    Grow an n x n title similarity matrix by m new titles without recomputing it.
+
+    ``cross`` holds the (m, n + m) similarities of the new titles to all titles,
+    old ones first. Works for plain and quantized matrices; for int8, the new
+    columns of old rows reuse those rows' scales. Returns the extended matrix
+    and its spare buffers; passing those back with the next call lets repeated
+    additions write only the new rows and columns until the capacity runs out.
+
+    Old rows keep the idf weights of when they were vectorized while new titles
+    get the current ones, so scores drift as the catalog grows; callers bound
+    this by re-vectorizing everything after REWEIGHT_AFTER growth.
+    """
+    n, m = len(similarity), len(cross)
+    cross = np.asarray(cross)
+    if not isinstance(similarity, QuantizedMatrix):
+        extended, spare = _grow(similarity, (n + m, n + m), spare)
+        extended[:n, n:] = cross[:, :n].T
+        extended[n:] = cross
+        return extended, spare
+
+    value_buffer, scale_buffer = spare if spare is not None else (None, None)
+    new_rows = QuantizedMatrix.from_dense(cross, similarity.precision)
+    values, value_buffer = _grow(similarity.values, (n + m, n + m), value_buffer)
+    values[n:] = new_rows.values
+    if similarity.scales is None:
+        values[:n, n:] = cross[:, :n].T
+        return QuantizedMatrix(values), (value_buffer, None)
+    safe = np.where(similarity.scales > 0, similarity.scales, 1)
+    values[:n, n:] = np.clip(np.rint(cross[:, :n].T / safe[:, None]), -127, 127)
+    scales, scale_buffer = _grow(similarity.scales, (n + m,), scale_buffer)
+    scales[n:] = new_rows.scales
+    return QuantizedMatrix(values, scales), (value_buffer, scale_buffer)
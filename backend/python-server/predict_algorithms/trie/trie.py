@@ -7,6 +7,16 @@ class Trie:
     def __init__(self):
         self.root = TrieNode()
         self.all_words = set()  # Store all words for substring matching
+
+    def __getstate__(self):
+        # The node tree is as deep as the longest word, too deep for pickle; store the words instead
+        return {'words': sorted(self.all_words)}
+
+    def __setstate__(self, state):
+        # Sorted insertion, like build_trie, keeps the suggestion order
+        self.__init__()
+        for word in state['words']:
+            self.insert(word)
     
     def insert(self, word: str) -> None:
         # Insert word normally for prefix matching
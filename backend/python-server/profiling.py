@@ -0,0 +1,96 @@
+"""
+Opt-in cProfile traces of individual requests.
+
+A request is profiled when it carries the profiling header, or at random
+with probability PROFILE_SAMPLE_RATE. One request is profiled at a time (others
+run normally meanwhile), and only the newest PROFILE_MAX_FILES traces are
+kept in PROFILE_DIR. Traces are pstats files:
+
+    python -m pstats profiles/<name>.prof
+    snakeviz profiles/<name>.prof
+"""
+import cProfile
+import io
+import os
+import pstats
+import random
+import threading
+import time
+
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', '50'))
+PROFILE_HEADER = 'X-Profile'
+
+
+class RequestProfiler:
+    """
+    Profiles sampled or explicitly requested calls into a bounded directory.
+
+    Args:
+        directory (str): Where traces are written
+        sample_rate (float): Fraction of calls profiled without the header
+        max_files (int): Traces kept; the oldest are deleted first
+    """
+    def __init__(self, directory=PROFILE_DIR, sample_rate=PROFILE_SAMPLE_RATE, max_files=PROFILE_MAX_FILES):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.max_files = max_files
+        self._busy = threading.Lock()
+
+    def run(self, name, requested, fn, *args):
+        """fn(*args), profiled when requested or sampled (and no other call is being profiled)"""
+        if not (requested or (self.sample_rate and random.random() < self.sample_rate)):
+            return fn(*args)
+        if not self._busy.acquire(blocking=False):
+            return fn(*args)
+        try:
+            profile = cProfile.Profile()
+            start = time.perf_counter()
+            try:
+                return profile.runcall(fn, *args)
+            finally:
+                self._save(profile, name, time.perf_counter() - start)
+        finally:
+            self._busy.release()
+
+    def _save(self, profile, name, seconds):
+        os.makedirs(self.directory, exist_ok=True)
+        # Nanoseconds keep names unique within a second
+        stamp = f"{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 10**9:09d}"
+        path = os.path.join(self.directory, f"{stamp}-{name}-{seconds * 1000:.0f}ms.prof")
+        profile.dump_stats(path)
+        for old in self.traces()[self.max_files:]:
+            try:
+                os.remove(os.path.join(self.directory, old['name']))
+            except FileNotFoundError:
+                pass
+
+    def traces(self):
+        """Saved traces, newest first"""
+        try:
+            names = [name for name in os.listdir(self.directory) if name.endswith('.prof')]
+        except FileNotFoundError:
+            return []
+        traces = []
+        for name in names:
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            traces.append({'name': name, 'bytes': stat.st_size, 'created': stat.st_mtime})
+        return sorted(traces, key=lambda trace: (trace['created'], trace['name']), reverse=True)
+
+    def path_of(self, name):
+        """Path of a saved trace, or None for unknown (or path-like) names"""
+        if not name or os.path.basename(name) != name or not name.endswith('.prof'):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
+
+    def summary(self, name, limit=40, sort='cumulative'):
+        """pstats text report of a saved trace, sorted by a pstats key such as 'cumulative' or 'tottime'"""
+        out = io.StringIO()
+        stats = pstats.Stats(self.path_of(name), stream=out)
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+        return out.getvalue()
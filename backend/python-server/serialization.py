@@ -0,0 +1,174 @@
+"""
+JSON encoding of API responses, and a cache of ready-encoded response bodies.
+
+Uses orjson when it is installed (several times faster than the standard
+library and handles NumPy values), json otherwise. Hot cacheable responses
+(autocomplete per prefix, recommendations per product) are stored as
+EncodedBody bytes, with a gzip copy made up front, so repeated requests skip
+building, encoding and compressing them. Uncached bodies are only compressed
+when the client accepts gzip. Long responses can instead be streamed
+as a StreamingBody.
+"""
+import gzip
+import json
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+from metrics import span
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Bodies at least this large are gzipped for clients that accept it (0 disables)
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+
+
+def _default(value):
+    # NumPy scalars/arrays from the models, for the json fallback
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(body):
+    """JSON bytes of body"""
+    if orjson is not None:
+        return orjson.dumps(body, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(body, default=_default).encode()
+
+
+def loads(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def accepts_gzip(accept_encoding):
+    """Whether an Accept-Encoding header accepts gzip with a non-zero q-value (gzip;q=0 refuses it)"""
+    if not accept_encoding:
+        return False
+    return _accepts_gzip(accept_encoding.lower())
+
+
+@lru_cache(maxsize=256)  # Clients send a handful of distinct headers
+def _accepts_gzip(accept_encoding):
+    qualities = {}
+    for item in accept_encoding.split(','):
+        coding, *params = (part.strip() for part in item.split(';'))
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding] = quality
+    # An explicit gzip entry overrides the * wildcard
+    quality = qualities.get('gzip', qualities.get('x-gzip', qualities.get('*', 0.0)))
+    return quality > 0
+
+
+class EncodedBody:
+    """
+    A response body encoded once. Its gzip copy is made the first time a client
+    that accepts gzip asks for it (when the body is worth compressing) and kept.
+    """
+    __slots__ = ('data', 'content_type', 'compress_min_bytes', '_gzipped')
+
+    def __init__(self, data, compress_min_bytes=COMPRESS_MIN_BYTES, content_type='application/json'):
+        self.data = data
+        self.content_type = content_type
+        self.compress_min_bytes = compress_min_bytes
+        self._gzipped = None
+
+    @classmethod
+    def of(cls, body):
+        return body if isinstance(body, cls) else cls(dumps(body))
+
+    def gzipped(self):
+        """The gzip copy, compressed on first use, or None when the body is too small to be worth it"""
+        if self._gzipped is None and self.compress_min_bytes and len(self.data) >= self.compress_min_bytes:
+            # Concurrent first calls may both compress; the result is the same
+            self._gzipped = gzip.compress(self.data, compresslevel=6, mtime=0)
+        return self._gzipped
+
+    def for_client(self, accept_encoding):
+        """(bytes, content encoding or None) to send to a client with this Accept-Encoding header"""
+        if accepts_gzip(accept_encoding):
+            gzipped = self.gzipped()
+            if gzipped is not None:
+                return gzipped, 'gzip'
+        return self.data, None
+
+
+class StreamingBody:
+    """
+    A response body sent chunk by chunk as an iterator produces it (e.g. NDJSON).
+
+    on_close runs once, when the body is exhausted or the server closes it
+    (including when the client disconnects before the end).
+    """
+    def __init__(self, chunks, content_type='application/x-ndjson', on_close=None):
+        self.chunks = iter(chunks)
+        self.content_type = content_type
+        self.on_close = on_close
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.chunks)
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self):
+        if hasattr(self.chunks, 'close'):
+            self.chunks.close()
+        on_close, self.on_close = self.on_close, None
+        if on_close is not None:
+            on_close()
+
+
+def ndjson_lines(records):
+    """One NDJSON chunk (one JSON document per line) of records"""
+    return b''.join(dumps(record) + b'\n' for record in records)
+
+
+class ResponseCache:
+    """Thread-safe LRU cache of EncodedBody by key"""
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(self, key, build, *args):
+        """Cached body for key, or build(*args) encoded and stored"""
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return body
+            self.misses += 1
+        body = build(*args)
+        with span('encode'):
+            body = EncodedBody.of(body)
+            body.gzipped()  # Cached bodies are reused, so compress once up front instead of on a request
+        with self._lock:
+            self._entries[key] = body
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return body
+
+    def __len__(self):
+        return len(self._entries)
+
+    def status(self):
+        return {'entries': len(self), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,268 @@
+"""
+Production launch mode: load the models once in a parent process, then fork
+worker processes that share them copy-on-write.
+
+    python serve.py --workers 4 --port 5000
+    python serve.py --benchmark --workers 1,2,4
+
+The parent waits for every component to be ready, freezes the garbage
+collector (so workers' collections never write to the shared objects'
+headers) and only then forks. Workers each run a threaded WSGI server on the
+shared listening socket. SIGHUP (also sent by a worker's /admin/reload) reloads
+the models in the parent and replaces the workers one by one; SIGTERM/SIGINT
+stop everything. A stopping worker accepts no new connections and lets the
+requests in flight finish for up to WORKER_GRACE_SECONDS.
+"""
+import argparse
+import gc
+import http.client
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import make_server
+from werkzeug.wsgi import ClosingIterator
+
+# How long a stopping worker lets requests in flight (and NDJSON streams) finish
+WORKER_GRACE_SECONDS = float(os.environ.get('WORKER_GRACE_SECONDS', '30'))
+
+
+def freeze_shared_state():
+    """Collect garbage once, then move everything alive into the permanent GC generation"""
+    gc.collect()
+    gc.freeze()
+
+
+def worker_memory(pid):
+    """RSS, PSS and shared/private memory of a process in MB, from /proc (Linux)"""
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup', 'r', encoding='utf-8') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return {
+        'rss_mb': fields.get('Rss', 0.0),
+        'pss_mb': fields.get('Pss', 0.0),
+        'shared_mb': fields.get('Shared_Clean', 0.0) + fields.get('Shared_Dirty', 0.0),
+        'private_mb': fields.get('Private_Clean', 0.0) + fields.get('Private_Dirty', 0.0),
+    }
+
+
+class InFlight:
+    """WSGI wrapper counting requests whose response, including a streamed body, is not finished"""
+    def __init__(self, app):
+        self.app = app
+        self.count = 0
+        self._idle = threading.Condition()
+
+    def __call__(self, environ, start_response):
+        with self._idle:
+            self.count += 1
+        try:
+            response = self.app(environ, start_response)
+        except BaseException:
+            self._finished()
+            raise
+        return ClosingIterator(response, self._finished)
+
+    def _finished(self):
+        with self._idle:
+            self.count -= 1
+            if not self.count:
+                self._idle.notify_all()
+
+    def wait(self, timeout):
+        """Block until no request is in flight or timeout seconds passed; False on timeout"""
+        with self._idle:
+            return self._idle.wait_for(lambda: not self.count, timeout)
+
+
+def _run_worker(app, sock, grace_seconds=WORKER_GRACE_SECONDS):
+    in_flight = InFlight(app)
+    server = make_server(*sock.getsockname()[:2], in_flight, threaded=True, fd=sock.fileno())
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever to return, so it can't run in this (the serving) thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # The parent handles Ctrl+C
+    signal.signal(signal.SIGHUP, signal.SIG_DFL)
+    server.serve_forever()
+    # No new connections are accepted here (the other workers take them); request threads
+    # are daemons, so wait for those in flight before the process exits
+    if not in_flight.wait(grace_seconds):
+        print(f"Worker {os.getpid()} stopped with {in_flight.count} requests still running")
+
+
+class PreforkServer:
+    """Parent process of the prefork mode: owns the socket, the models and the workers"""
+    def __init__(self, app, registry, host='0.0.0.0', port=5000, workers=None):
+        self.app = app
+        self.registry = registry
+        self.workers = workers or os.cpu_count() or 1
+        self.sock = socket.create_server((host, port), backlog=1024, reuse_port=False)
+        self.sock.set_inheritable(True)
+        self.pids = set()
+        self.stopping = False
+        self.reload_requested = False
+
+    def _fork_worker(self):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                # A reload inside one worker would leave the others on the old models
+                self.registry.reload_parent = os.getppid()
+                _run_worker(self.app, self.sock)
+            finally:
+                os._exit(0)
+        self.pids.add(pid)
+        return pid
+
+    def _stop_worker(self, pid):
+        try:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+        self.pids.discard(pid)
+
+    def _reload(self):
+        """Load new models in the parent, then roll the workers onto them one at a time"""
+        print("Reloading models...")
+        try:
+            self.registry.load()
+        except Exception as e:
+            print(f"Reload failed, keeping the current workers: {e}")
+            return
+        freeze_shared_state()
+        for pid in list(self.pids):
+            self._fork_worker()
+            self._stop_worker(pid)
+        print(f"Workers now serve model version {self.registry.version}")
+
+    def memory_report(self):
+        report = {pid: worker_memory(pid) for pid in sorted(self.pids)}
+        for pid, memory in report.items():
+            print(f"Worker {pid}: RSS {memory['rss_mb']:.1f}MB, PSS {memory['pss_mb']:.1f}MB, "
+                  f"shared {memory['shared_mb']:.1f}MB, private {memory['private_mb']:.1f}MB")
+        return report
+
+    def start(self):
+        self.registry.wait()
+        if not self.registry.is_ready():
+            raise RuntimeError(f"Models failed to load: {self.registry.components}")
+        freeze_shared_state()
+        for _ in range(self.workers):
+            self._fork_worker()
+        host, port = self.sock.getsockname()[:2]
+        print(f"Serving model version {self.registry.version} on {host}:{port} with {self.workers} workers")
+
+    def stop(self):
+        self.stopping = True
+        for pid in list(self.pids):
+            self._stop_worker(pid)
+        self.sock.close()
+
+    def serve_forever(self):
+        """Start the workers and supervise them until SIGTERM/SIGINT"""
+        def request_stop(signum, frame):
+            self.stopping = True
+
+        def request_reload(signum, frame):
+            self.reload_requested = True
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+        signal.signal(signal.SIGHUP, request_reload)
+        self.start()
+        while not self.stopping:
+            if self.reload_requested:
+                self.reload_requested = False
+                self._reload()
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            if pid and pid in self.pids:
+                self.pids.discard(pid)
+                print(f"Worker {pid} exited with status {status}, restarting")
+                self._fork_worker()
+            time.sleep(0.2)
+        self.stop()
+
+
+def benchmark(host, port, path, requests=2000, concurrency=16):
+    """Requests/sec, 5xx responses and p99 latency (ms) of GET path with `concurrency` keep-alive clients"""
+    per_client = max(1, requests // concurrency)
+
+    def client(_):
+        conn = http.client.HTTPConnection(host, port, timeout=30)
+        errors, latencies = 0, []
+        for _ in range(per_client):
+            sent = time.perf_counter()
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            latencies.append(time.perf_counter() - sent)
+            errors += response.status >= 500
+        conn.close()
+        return errors, latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(client, range(concurrency)))
+    elapsed = time.perf_counter() - start
+    errors = sum(client_errors for client_errors, _ in results)
+    latencies = sorted(latency for _, client_latencies in results for latency in client_latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+    return per_client * concurrency / elapsed, errors, p99
+
+
+def run_benchmark(worker_counts, port, path, requests, concurrency):
+    """For each worker count: fork a server, report per-worker memory and requests/sec"""
+    from app import app, registry
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # No per-request log lines
+    results = {}
+    for workers in worker_counts:
+        server = PreforkServer(app, registry, '127.0.0.1', port, workers)
+        server.start()
+        time.sleep(0.5)
+        rate, errors, p99 = benchmark('127.0.0.1', port, path, requests, concurrency)
+        print(f"{workers} worker(s): {rate:.0f} requests/sec on {path}, p99 {p99:.0f}ms ({errors} errors)")
+        memory = server.memory_report()
+        server.stop()
+        results[workers] = {'requests_per_sec': rate, 'errors': errors, 'p99_ms': p99, 'memory': memory}
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', default=str(os.cpu_count() or 1),
+                        help="Number of workers (comma-separated list with --benchmark)")
+    parser.add_argument('--benchmark', action='store_true', help="Measure requests/sec and worker memory")
+    parser.add_argument('--path', default='/get_recommendation?user_id=1', help="Benchmarked request")
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args(argv)
+
+    if args.benchmark:
+        run_benchmark([int(n) for n in args.workers.split(',')], args.port, args.path,
+                      args.requests, args.concurrency)
+        return
+
+    from app import app, registry
+    PreforkServer(app, registry, args.host, args.port, int(args.workers)).serve_forever()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
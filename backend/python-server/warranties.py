@@ -0,0 +1,94 @@
+import zlib
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+WARRANTY_DAYS = 365  # Warranty dates are drawn from the last year, both ends included
+
+icon_defaults = {
+    "cpu": "chip",
+    "gpu": "chip",
+    "soundcard": "developer-board",
+    "sound_card": "developer-board",
+    'videocards':"developer-board",
+    "motherboard": "developer-board",
+    "ram": "memory",
+    "storage": "storage_icon",
+    "network": "network_icon",
+    "power": "power_icon",
+    "cartrige":"printer",
+    "hdd":"harddisk",
+
+}
+
+
+def add_warranty_columns(df):
+    """
+    Precompute the per-event warranty title (last segment of category_code)
+    and icon name once at load, so requests don't parse strings per row.
+    """
+    titles = df['category_code'].fillna('').astype(str).str.split('.').str[-1]
+    lowered = titles.str.lower()
+    df['warranty_title'] = titles
+    df['warranty_icon'] = lowered.map(icon_defaults).fillna(lowered)
+    return df
+
+
+@lru_cache(maxsize=2)
+def _day_tables(today):
+    """Date string, past and future timeAgo text for every possible day offset, for one date"""
+    today = datetime.strptime(today, '%Y-%m-%d')
+    dates, past, future = [], [], []
+    for days in range(WARRANTY_DAYS + 1):
+        dates.append((today - timedelta(days=days)).strftime('%d/%m/%Y'))
+        if days < 30:
+            past.append(f"{days} days ago")
+            future.append(past[-1])
+        elif days < 365:
+            months = days // 30
+            past.append(f"{months} months ago")
+            future.append(f"in {months} months")
+        else:
+            years = days // 365
+            past.append(f"{years} year ago" if years == 1 else f"{years} years ago")
+            future.append(past[-1])
+    return np.array(dates, dtype=object), np.array(past, dtype=object), np.array(future, dtype=object)
+
+
+def build_warranties(user_events, user_id, seed=0, today=None, start=0):
+    """
+    Warranty items for a user's events, built with array operations.
+
+    Dates come from a NumPy generator seeded with (seed, user_id), so the same
+    user gets the same response; all strings come from per-day lookup tables.
+    Item i uses the generator's draws 2i and 2i+1, so any slice of the user's
+    events (a page, a streamed chunk) gets the same items as the full list.
+
+    Args:
+        user_events (DataFrame): warranty_title, warranty_icon and brand columns
+        user_id: Id the generator is seeded with
+        seed (int): Base seed
+        today (datetime, optional): Reference date (default: now)
+        start (int): Position of the first of user_events among all the user's events
+    """
+    today = today or datetime.now()
+    dates, past, future = _day_tables(today.strftime('%Y-%m-%d'))
+    bit_generator = np.random.PCG64([seed, zlib.crc32(str(user_id).encode())])
+    bit_generator.advance(2 * start)  # random() takes exactly one 64-bit draw per value
+    n = len(user_events)
+    draws = np.random.Generator(bit_generator).random((n, 2))
+    days = (draws[:, 0] * (WARRANTY_DAYS + 1)).astype(np.int64)
+    upcoming = draws[:, 1] < 0.5
+
+    brands = user_events['brand'].astype(object)
+    warranties = pd.DataFrame({
+        'title': user_events['warranty_title'].to_numpy(),
+        'subtitle': brands.where(brands.notna(), None).to_numpy(),
+        'date': dates[days],
+        'timeAgo': np.where(upcoming, future[days], past[days]),
+        'iconName': user_events['warranty_icon'].to_numpy(),
+        'progress': np.clip(days / WARRANTY_DAYS * 100, 0, 100),  # Represented as a percentage (0 to 100)
+    })
+    return warranties.to_dict('records')